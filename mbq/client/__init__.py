@@ -1,4 +1,12 @@
-from .authenticator import Authenticator  # noqa
+from .async_client import AsyncServiceClient  # noqa
+from .authenticator import AsyncAuthenticator, Authenticator  # noqa
+from .cache import DjangoCacheBackend, HTTPCache, LRUCacheBackend  # noqa
+from .circuit_breaker import CircuitBreaker  # noqa
 from .client import ServiceClient  # noqa
-from .storage import DjangoCacheStorage, FileStorage  # noqa
+from .exceptions import CircuitOpenError, DeadlineExceeded  # noqa
+from .instrumentation import RequestHook  # noqa
+from .registry import TokenRegistry  # noqa
+from .retry import RetryPolicy  # noqa
+from .streaming import ResponseStream  # noqa
+from .storage import DjangoCacheStorage, FileStorage, SQLiteStorage  # noqa
 from .token_manager import TokenManager  # noqa
@@ -0,0 +1,75 @@
+from .client import BaseServiceClient
+
+
+class AsyncServiceClient(BaseServiceClient):
+    """ asyncio counterpart of ServiceClient for ASGI services.
+
+    URLs, headers, correlation ids and responses are handled exactly as in ServiceClient.
+    Requests go through an httpx.AsyncClient (install mbq.client[async]) with its own
+    connection pool, sized by max_connections and max_keepalive_connections; any object
+    with a compatible `request` coroutine can be passed as transport instead. Errors
+    are raised as the transport's exceptions, e.g. httpx.HTTPStatusError for bad responses.
+
+    auth must be an AsyncAuthenticator (or anything else with a
+    get_authorization_async coroutine) so token fetches don't block the event loop.
+    """
+
+    def __init__(self, api_url, auth=None, headers=None, post_process_response=None,
+                 correlation_id_getter=None, default_timeout=30, max_connections=100,
+                 max_keepalive_connections=20, transport=None, decoders=None):
+        super().__init__(
+            api_url,
+            auth=auth,
+            headers=headers,
+            post_process_response=post_process_response,
+            correlation_id_getter=correlation_id_getter,
+            default_timeout=default_timeout,
+            decoders=decoders,
+        )
+
+        if transport is None:
+            import httpx
+
+            transport = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ))
+        self.session = transport
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def _make_request(self, method, url, **kwargs):
+        kwargs['headers'] = self._make_headers(kwargs.get('headers'))
+
+        auth = kwargs.pop('auth', self._auth)
+        if auth is not None:
+            kwargs['headers']['Authorization'] = await auth.get_authorization_async()
+
+        if self._timeout and 'timeout' not in kwargs:
+            kwargs['timeout'] = self._timeout
+
+        response = await self.session.request(method.upper(), self._make_url(url), **kwargs)
+
+        return self._handle_response(response)
+
+    async def get(self, *args, **kwargs):
+        return await self._make_request('get', *args, **kwargs)
+
+    async def post(self, *args, **kwargs):
+        return await self._make_request('post', *args, **kwargs)
+
+    async def patch(self, *args, **kwargs):
+        return await self._make_request('patch', *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self._make_request('put', *args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        return await self._make_request('delete', *args, **kwargs)
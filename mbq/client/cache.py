@@ -0,0 +1,265 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+from urllib.parse import urlparse
+
+import requests
+
+from .authenticator import AuthWrapper
+from .lib.metrics import NullCollector
+
+
+def get_auth_identity(auth, url):
+    """ Returns a string naming the credentials auth sends to url, or None when they can't
+    be told apart from another auth's. Only authenticators for a service (including a
+    TokenRegistry) and basic auth can be told apart.
+    """
+    while isinstance(auth, AuthWrapper):
+        auth = auth.auth
+
+    if auth is None:
+        return 'anonymous'
+
+    if isinstance(auth, tuple):
+        username, password = auth
+    else:
+        service_name = getattr(auth, 'service_name', None)
+        if service_name is not None:
+            return 'service:{}'.format(service_name)
+        if hasattr(auth, 'get_service_name'):
+            try:
+                return 'service:{}'.format(auth.get_service_name(url))
+            except ValueError:
+                return None
+        username = getattr(auth, 'username', None)
+        password = getattr(auth, 'password', None)
+
+    if username is None:
+        return None
+    # Keys can end up in a shared cache, so the password is only kept as a digest.
+    password_digest = hashlib.sha256(str(password).encode('utf-8')).hexdigest()
+    return 'basic:{}:{}'.format(username, password_digest)
+
+
+def make_request_key(method, url, kwargs):
+    """ Identifies a request by its method, full URL, the headers it was sent with and
+    the credentials it was sent with. Returns None for requests whose credentials can't
+    be identified (see get_auth_identity), whose responses mustn't be shared.
+    """
+    identity = get_auth_identity(kwargs.get('auth'), url)
+    if identity is None:
+        return None
+
+    url = requests.Request(method, url, params=kwargs.get('params')).prepare().url
+    headers = sorted(
+        (name.lower(), value) for name, value in (kwargs.get('headers') or {}).items()
+        if name.lower() != 'x-correlation-id'
+    )
+    return '{} {} {} {}'.format(method.upper(), url, headers, identity)
+
+
+def parse_cache_control(value):
+    """ Returns the directives of a Cache-Control header as a dict. Directives without
+    a value, such as no-store, map to None.
+    """
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def parse_http_date(value):
+    parsed = parsedate_tz(value or '')
+    return mktime_tz(parsed) if parsed else None
+
+
+def get_freshness_lifetime(headers):
+    """ Returns how many seconds a response may be served from cache according to its
+    Cache-Control and Expires headers, or None when it says nothing about it.
+    """
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-cache' in cache_control:
+        return 0
+    if 'max-age' in cache_control:
+        try:
+            return max(int(cache_control['max-age']), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    if 'Expires' in headers:
+        expires = parse_http_date(headers['Expires'])
+        if expires is None:
+            # Invalid dates, such as 0, mean already expired.
+            return 0
+        date = parse_http_date(headers.get('Date')) or time.time()
+        return max(expires - date, 0)
+
+    return None
+
+
+class LRUCacheBackend:
+    """ Keeps up to max_entries responses in process memory, evicting the least recently
+    used first.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._entries.get(key, (None, None))
+            if value is None:
+                return None
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DjangoCacheBackend:
+    """ Keeps responses in a Django cache, so processes can share them. Keys are hashed
+    to stay within memcached's key length limit.
+    """
+
+    def __init__(self, cache, key_prefix='mbq.client.http'):
+        self.cache = cache
+        self.key_prefix = key_prefix
+
+    def _make_key(self, key):
+        return '{}:{}'.format(self.key_prefix, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.cache.get(self._make_key(key))
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(self._make_key(key), value, timeout=timeout)
+
+    def delete(self, key):
+        self.cache.delete(self._make_key(key))
+
+
+class HTTPCache:
+    """ Cache for ServiceClient GETs that return JSON.
+
+    How long a response is served from cache follows its Cache-Control max-age or
+    Expires header, unless routes has an override: routes maps URL path prefixes
+    (e.g. '/api/v1/config/') to a lifetime in seconds, with 0 meaning never cache, and the
+    longest matching prefix wins. Responses that say nothing about their lifetime use
+    default_ttl, and are not cached when it's None. Cache-Control: no-store responses
+    are never cached.
+
+    Once stale, responses with an ETag or Last-Modified header are kept for another
+    keep_stale seconds and revalidated with If-None-Match/If-Modified-Since, so an
+    unchanged resource costs a 304 instead of a full body. Bodies larger than
+    max_entry_size bytes are not cached.
+
+    Entries hold the decoded, post-processed data, so hits skip JSON decoding as well
+    as the request. With LRUCacheBackend (the default) every hit returns the same
+    object, which callers must not modify.
+    """
+
+    def __init__(self, backend=None, routes=None, default_ttl=None, keep_stale=3600,
+                 max_entry_size=1024 * 1024, collector=None):
+        self.backend = backend or LRUCacheBackend()
+        self.routes = sorted((routes or {}).items(), key=lambda route: len(route[0]), reverse=True)
+        self.default_ttl = default_ttl
+        self.keep_stale = keep_stale
+        self.max_entry_size = max_entry_size
+        self.collector = collector or NullCollector()
+        self.stats = Counter()
+
+    def make_key(self, url, kwargs):
+        """ Returns the key a GET is cached under, or None if it mustn't be cached. """
+        return make_request_key('GET', url, kwargs)
+
+    def _get_route_ttl(self, url):
+        path = urlparse(url).path
+        for prefix, ttl in self.routes:
+            if path.startswith(prefix):
+                return ttl
+        return None
+
+    def get(self, key):
+        """ Returns the entry cached for key, if any, and whether it is still fresh. """
+        entry = self.backend.get(key)
+        if entry is None:
+            self._count('miss')
+            return None, False
+
+        fresh = entry['fresh_until'] > time.time()
+        self._count('hit' if fresh else 'stale')
+        return entry, fresh
+
+    def get_conditional_headers(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def revalidate(self, key, entry, response):
+        """ Refreshes a stale entry after the server answered 304 Not Modified. """
+        self._count('revalidated')
+        self._save(key, response.url, response.headers, entry['data'], entry)
+        return entry['data']
+
+    def store(self, key, response, data):
+        if response.status_code != 200 or len(response.content) > self.max_entry_size:
+            return
+        content_type = response.headers.get('Content-Type') or ''
+        media_type = content_type.split(';')[0].strip().lower()
+        if media_type == 'application/json' or media_type.endswith('+json'):
+            self._save(key, response.url, response.headers, data)
+
+    def _save(self, key, url, headers, data, previous=None):
+        previous = previous or {}
+        if 'no-store' in parse_cache_control(headers.get('Cache-Control')):
+            self.backend.delete(key)
+            return
+
+        ttl = self._get_route_ttl(url)
+        if ttl == 0:
+            return
+        if ttl is None:
+            ttl = get_freshness_lifetime(headers)
+        if ttl is None:
+            ttl = self.default_ttl
+
+        etag = headers.get('ETag') or previous.get('etag')
+        last_modified = headers.get('Last-Modified') or previous.get('last_modified')
+        validated = bool(etag or last_modified)
+        if not ttl and not validated:
+            # Nothing to serve it for and nothing to revalidate it with.
+            return
+
+        ttl = ttl or 0
+        self.backend.set(key, {
+            'data': data,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh_until': time.time() + ttl,
+        }, timeout=max(ttl + (self.keep_stale if validated else 0), 1))
+
+    def _count(self, outcome):
+        self.stats[outcome] += 1
+        self.collector.increment('cache.{}'.format(outcome))
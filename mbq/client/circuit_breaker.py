@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+
+from .exceptions import CircuitOpenError, DeadlineExceeded
+from .lib.metrics import NullCollector
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class Circuit:
+    """ Breaker state for a single host. See CircuitBreaker. """
+
+    def __init__(self, breaker, host):
+        self.breaker = breaker
+        self.host = host
+        self.state = CLOSED
+        self.generation = 0
+        self.calls = deque(maxlen=breaker.window_size)
+        self.opened_at = None
+        self.probes = 0
+        self.probe_successes = 0
+
+    def acquire(self):
+        """ Returns None if no call may be made now, or else a token to pass to record()
+        or release() once it's done. Must be called under the breaker's lock.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.breaker.open_duration:
+                return None
+            self.transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self.probes >= self.breaker.half_open_calls:
+                return None
+            self.probes += 1
+
+        return self.generation
+
+    def release(self, token):
+        """ Ends a call without recording its outcome. Must be called under the breaker's
+        lock.
+        """
+        if token == self.generation and self.state == HALF_OPEN:
+            self.probes -= 1
+
+    def record(self, token, failed, slow):
+        """ Records the outcome of a call. Must be called under the breaker's lock. """
+        if token != self.generation:
+            # The call was let through before the circuit last changed state, so it
+            # says nothing about the current one, e.g. it isn't a half-open probe.
+            return
+
+        if self.state == HALF_OPEN:
+            self.probes -= 1
+            if failed or slow:
+                self.transition(OPEN)
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.breaker.half_open_calls:
+                self.transition(CLOSED)
+            return
+
+        if self.state != CLOSED:
+            return
+
+        self.calls.append((failed, slow))
+        if len(self.calls) < self.breaker.minimum_calls:
+            return
+
+        failure_rate = sum(failed for failed, _ in self.calls) / len(self.calls)
+        slow_call_rate = sum(slow for _, slow in self.calls) / len(self.calls)
+        if (failure_rate >= self.breaker.failure_rate_threshold
+                or slow_call_rate >= self.breaker.slow_call_rate_threshold):
+            logger.warning(
+                'Opening circuit for {}: {:.0%} of recent calls failed, {:.0%} were slow'.format(
+                    self.host, failure_rate, slow_call_rate,
+                )
+            )
+            self.transition(OPEN)
+
+    def transition(self, state):
+        self.state = state
+        self.generation += 1
+        self.calls.clear()
+        self.probes = self.probe_successes = 0
+        self.opened_at = time.monotonic() if state == OPEN else None
+
+        tags = {'host': self.host}
+        self.breaker.collector.gauge('circuit_breaker.state', STATE_VALUES[state], tags=tags)
+        self.breaker.collector.increment('circuit_breaker.{}'.format(state), tags=tags)
+
+
+class CircuitBreaker:
+    """ Stops calls to a host that is failing, so callers fail fast instead of waiting
+    out their timeouts. Each host has its own circuit.
+
+    A circuit starts closed. Once at least minimum_calls of the last window_size calls
+    have been made, it opens if failure_rate_threshold of them failed (connection errors,
+    timeouts and 5xx responses) or slow_call_rate_threshold of them took longer than
+    slow_call_duration seconds. An open circuit rejects calls with CircuitOpenError for
+    open_duration seconds, then lets half_open_calls probe calls through: it closes
+    again if they all succeed and reopens on the first failure.
+
+    State changes are sent to collector as circuit_breaker.state gauges (0 closed,
+    1 half open, 2 open) and circuit_breaker.<state> counters, tagged with the host;
+    rejected calls are counted as circuit_breaker.rejected.
+    """
+
+    def __init__(self, failure_rate_threshold=0.5, slow_call_rate_threshold=1.0,
+                 slow_call_duration=10, minimum_calls=10, window_size=20, open_duration=30,
+                 half_open_calls=1, collector=None):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.minimum_calls = minimum_calls
+        self.window_size = window_size
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.collector = collector or NullCollector()
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _get_circuit(self, host):
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits.setdefault(host, Circuit(self, host))
+        return circuit
+
+    def get_state(self, host):
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit.state == OPEN and (
+                    time.monotonic() - circuit.opened_at >= self.open_duration):
+                return HALF_OPEN
+            return circuit.state
+
+    def get_states(self):
+        return {host: self.get_state(host) for host in list(self._circuits)}
+
+    def is_failure(self, response=None, error=None):
+        if error is not None:
+            # Running out of a caller's deadline says nothing about the host.
+            return (isinstance(error, (requests.ConnectionError, requests.Timeout))
+                    and not isinstance(error, DeadlineExceeded))
+        return response.status_code >= 500
+
+    def call(self, host, send):
+        """ Calls send() unless the circuit for host is open, and records the outcome. """
+        with self._lock:
+            token = self._get_circuit(host).acquire()
+        if token is None:
+            self.collector.increment('circuit_breaker.rejected', tags={'host': host})
+            raise CircuitOpenError('Circuit breaker for {} is open'.format(host))
+
+        start = time.monotonic()
+        try:
+            response = send()
+        except DeadlineExceeded:
+            # Neither a failure nor a success of the host.
+            with self._lock:
+                self._get_circuit(host).release(token)
+            raise
+        except BaseException as e:
+            self._record(host, token, start, self.is_failure(error=e))
+            raise
+
+        self._record(host, token, start, self.is_failure(response=response))
+        return response
+
+    def _record(self, host, token, start, failed):
+        slow = time.monotonic() - start >= self.slow_call_duration
+        with self._lock:
+            self._get_circuit(host).record(token, failed, slow)
@@ -1,26 +1,94 @@
 import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
 from io import BufferedReader, BytesIO
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .authenticator import AuthWrapper
+from .cache import make_request_key
+from .exceptions import DeadlineExceeded
+from .instrumentation import RouteTemplates, get_status_class
+from .lib import serialization
+from .lib.compression import check_encoding, compress
+from .lib.deadlines import cap_timeout, deadline_scope
+from .lib.metrics import NullCollector
+from .retry import NO_RETRY
+from .streaming import DEFAULT_CHUNK_SIZE, ResponseStream
 
 
 logger = logging.getLogger(__name__)
 
 
-class ServiceClient:
+class DeadlineAuth(AuthWrapper):
+    """ Bounds fetching the token for a request by its deadline, checks the deadline once
+    the token has been added, and tells the service how many milliseconds of it are left.
+    """
+
+    def __init__(self, auth, deadline, header):
+        super().__init__(auth)
+        self.deadline = deadline
+        self.header = header
+
+    def __call__(self, request):
+        with deadline_scope(self.deadline):
+            request = super().__call__(request)
+
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline passed before the request was sent')
+        request.headers[self.header] = str(int(remaining * 1000))
+        return request
+
+    def invalidate(self, *args, **kwargs):
+        # Invalidating may fetch a new token straight away.
+        with deadline_scope(self.deadline):
+            return self.auth.invalidate(*args, **kwargs)
+
+
+class TimedAuth(AuthWrapper):
+    """ Measures how long a request's auth took, e.g. to fetch a token. """
+
+    duration = None
+
+    def __call__(self, request):
+        start = time.monotonic()
+        try:
+            return super().__call__(request)
+        finally:
+            self.duration = time.monotonic() - start
+
+
+class BaseServiceClient:
+    """ URL, header and response handling shared by the blocking and asyncio clients.
+
+    Response bodies are decoded according to their Content-Type: JSON media types are
+    parsed (and passed through post_process_response), empty bodies become None and
+    anything else is returned as a BufferedReader over the raw bytes. decoders maps
+    further media types to callables that take the response and return its data.
+    """
+
     def __init__(self, api_url, auth=None, headers=None, post_process_response=None,
-                 correlation_id_getter=None, default_timeout=30):
-        """ We use correlation_ids to track the flow of a request between different services.
-        It is the responsibility of users of ServiceClient to implement a correlation_id_getter
-        """
+                 correlation_id_getter=None, default_timeout=30, decoders=None):
         self._api_url = api_url
         self._auth = auth
         self._headers = headers
         self._post_process_response = post_process_response
         self._timeout = default_timeout
+        self._decoders = {}
         self.correlation_id_getter = correlation_id_getter
-        self.session = requests.Session()
+
+        for media_type, decoder in (decoders or {}).items():
+            self.register_decoder(media_type, decoder)
+
+    def register_decoder(self, media_type, decoder):
+        self._decoders[media_type.lower()] = decoder
 
     def _make_url(self, url):
         parsed = urlparse(url)
@@ -29,47 +97,659 @@ class ServiceClient:
 
         return url
 
-    def _make_request(self, method, url, *args, **kwargs):
+    def _make_headers(self, headers=None):
         if self._headers:
-            kwargs['headers'] = dict(self._headers, **kwargs.get('headers', {}))
-        else:
-            kwargs['headers'] = kwargs.get('headers', {})
+            headers = dict(self._headers, **(headers or {}))
+        elif headers is None:
+            headers = {}
 
         if self.correlation_id_getter is not None:
             cid = self.correlation_id_getter()
             if cid is not None:
-                kwargs['headers']['X-Correlation-Id'] = cid
+                headers['X-Correlation-Id'] = cid
+
+        return headers
+
+    def _raise_for_status(self, response):
+        try:
+            response.raise_for_status()
+        except: # noqa
+            msg = '{} Bad Response: {}'.format(response.status_code, response.content)
+            logger.error(msg)
+            raise
+
+    def _handle_response(self, response):
+        self._raise_for_status(response)
+
+        content_type = response.headers.get('content-type') or ''
+        media_type = content_type.split(';')[0].strip().lower()
+
+        decoder = self._decoders.get(media_type)
+        if decoder is not None:
+            return decoder(response)
+
+        if response.status_code == 204 or not response.content:
+            return None
+
+        if media_type == 'application/json' or media_type.endswith('+json'):
+            return self._decode_json(response.content)
+
+        if not media_type:
+            # Without a Content-Type all we can do is sniff the body.
+            try:
+                return self._decode_json(response.content)
+            except ValueError:
+                pass
+
+        return BufferedReader(BytesIO(response.content))
+
+    def _decode_json(self, content):
+        data = serialization.loads(content)
+        if self._post_process_response is not None:
+            data = self._post_process_response(data)
+        return data
+
+
+class ServiceClient(BaseServiceClient):
+    deadline_header = 'X-Deadline-Remaining-Ms'
+
+    def __init__(self, api_url, auth=None, headers=None, post_process_response=None,
+                 correlation_id_getter=None, default_timeout=30, pool_connections=10,
+                 pool_maxsize=10, pool_block=False, adapters=None, retry_policy=None,
+                 collector=None, stream_chunk_size=DEFAULT_CHUNK_SIZE, decoders=None,
+                 thread_safe=False, cache=None, coalesce=False, circuit_breaker=None,
+                 connect_timeout=None, read_timeout=None, deadline_getter=None, hooks=None,
+                 route_templates=None, compression=None, compression_threshold=16 * 1024,
+                 compression_level=None):
+        """ We use correlation_ids to track the flow of a request between different services.
+        It is the responsibility of users of ServiceClient to implement a correlation_id_getter
+
+        pool_connections is the number of per-host connection pools to keep around and
+        pool_maxsize the number of keep-alive connections each of those pools holds on to.
+        With pool_block=True a thread waits for a free connection instead of opening a
+        throwaway one once the pool is exhausted. adapters maps URL prefixes
+        (e.g. 'https://os-core.example.com') to transport adapters mounted on top of the
+        defaults, for hosts that need their own pool sizing.
+
+        connect_timeout and read_timeout (in seconds) override default_timeout for
+        establishing a connection and for waiting on the response respectively.
+
+        Calls can pass a deadline, the number of seconds they may take in all, including
+        fetching a token and any retries. Attempts are cut short to fit in it, no retry is
+        made that can't finish before it, and DeadlineExceeded is raised once it has
+        passed. The time left is sent in the X-Deadline-Remaining-Ms header so the service
+        can give up on work that can no longer finish in time. deadline_getter, like
+        correlation_id_getter, can supply the deadline for calls that don't pass one, e.g.
+        from the remaining budget of the request being served.
+
+        retry_policy is a RetryPolicy applied to every request, which can be overridden
+        per call with a retry_policy keyword argument. Retries are bounded by the policy's
+        total_timeout, or the client's timeouts when it has none. Requests whose body is a file or
+        an iterator, or that upload files, are only sent once.
+
+        collector is an optional mbq.metrics.Collector that receives request metrics.
+        Given one, every attempt at a request reports its latency (request.time), the
+        time spent in auth (request.auth.time) and the bytes sent and received, tagged
+        with the host, method, status class and route. Routes are the matching one of
+        route_templates (e.g. '/api/v1/people/{person_id}') or the path with its IDs
+        replaced by {id}, so tags don't get a value per object. hooks are RequestHooks,
+        e.g. for tracing, called around every attempt.
+
+        With compression set to 'gzip' or 'br' (which needs mbq.client[brotli]), json
+        bodies of POST, PUT and PATCH requests are serialized with orjson where it's
+        installed, and compressed once they reach compression_threshold bytes.
+        compression_level defaults to a level tuned for speed. A host that answers a
+        compressed body with 415 Unsupported Media Type gets the body again uncompressed,
+        and is sent uncompressed bodies from then on.
+
+        Calls made with stream=True return a ResponseStream over the socket instead of
+        the decoded body, for downloads too large to hold in memory. It is read in
+        stream_chunk_size chunks unless the call passes its own chunk_size, and
+        compressed bodies are decoded on the fly unless the call passes
+        decode_content=False.
+
+        circuit_breaker is an optional CircuitBreaker. Each attempt at a request goes
+        through the circuit of its scheme and host, and fails with CircuitOpenError
+        while that circuit is open. Clients can share a breaker or have their own.
+
+        cache is an optional HTTPCache for GETs that return JSON. Calls can skip it
+        by passing cache=False.
+
+        With coalesce=True, a GET made while an identical one (same URL, params, headers
+        and credentials) is in flight waits for that request and gets its result instead
+        of sending another. Coalesced calls share the decoded data, which callers must not
+        modify, and are counted in stats. Binary bodies are returned to each call as a
+        reader of its own. Every coalesced call keeps its own deadline. Neither caching
+        nor coalescing applies to calls whose credentials can't be told apart: only
+        Authenticators, a TokenRegistry and basic auth are identified.
+
+        map() sends a batch of requests concurrently, by default on as many threads as
+        there are pooled connections per host.
+
+        A requests.Session isn't guaranteed to be thread-safe. With thread_safe=True each
+        thread gets its own session, so cookies and other session state aren't shared,
+        while the transport adapters, and so the connection pools, are. Copies of the
+        client share its sessions as well. map() gives its worker threads their own
+        sessions either way.
+        """
+        super().__init__(
+            api_url,
+            auth=auth,
+            headers=headers,
+            post_process_response=post_process_response,
+            correlation_id_getter=correlation_id_getter,
+            default_timeout=default_timeout,
+            decoders=decoders,
+        )
+        if connect_timeout is not None or read_timeout is not None:
+            self._timeout = (
+                default_timeout if connect_timeout is None else connect_timeout,
+                default_timeout if read_timeout is None else read_timeout,
+            )
+        self.deadline_getter = deadline_getter
+        self._retry_policy = retry_policy or NO_RETRY
+        self.collector = collector or NullCollector()
+        self._hooks = list(hooks or [])
+        self._instrument = collector is not None or bool(self._hooks)
+        self._route_templates = RouteTemplates(route_templates)
+        self._stream_chunk_size = stream_chunk_size
+        if compression is not None:
+            check_encoding(compression)
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._compression_level = compression_level
+        self._uncompressed_hosts = set()
+        self._pool_maxsize = pool_maxsize
+        self._thread_safe = thread_safe
+        self._cache = cache
+        self._coalesce = coalesce
+        self._circuit_breaker = circuit_breaker
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.stats = Counter()
+        self._local = threading.local()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self._adapters = {'http://': adapter, 'https://': adapter}
+        self._adapters.update(adapters or {})
+        self._session = self._make_session()
+
+    def _make_session(self):
+        session = requests.Session()
+        for prefix, adapter in self._adapters.items():
+            session.mount(prefix, adapter)
+        return session
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if not self._thread_safe:
+                return self._session
+            session = self._local.session = self._make_session()
+        return session
+
+    @session.setter
+    def session(self, session):
+        # In thread-safe mode this only replaces the calling thread's session.
+        if self._thread_safe:
+            self._local.session = session
+        else:
+            self._session = session
+
+    def _use_own_session(self, session):
+        """ Gives the calling worker thread a session of its own, whether or not the client
+        is thread-safe, configured like session: the session of the thread that handed
+        it the work. Its adapters, and so its connection pools, are shared with session,
+        but cookies set on the worker's session aren't copied back.
+        """
+        if getattr(self._local, 'session', None) is not None:
+            return
+        own_session = requests.Session()
+        own_session.headers = session.headers.copy()
+        own_session.cookies = session.cookies.copy()
+        own_session.hooks = {event: list(hooks) for event, hooks in session.hooks.items()}
+        own_session.proxies = dict(session.proxies)
+        own_session.params = dict(session.params)
+        own_session.adapters = session.adapters.copy()
+        for name in ('auth', 'stream', 'verify', 'cert', 'max_redirects', 'trust_env'):
+            setattr(own_session, name, getattr(session, name))
+        self._local.session = own_session
+
+    def pool_stats(self):
+        """ Returns connection pool usage keyed by 'scheme://host:port'.
+
+        connections is the number of connections opened over the life of the pool and
+        requests the number of requests sent through it, so reused is how many requests
+        got a keep-alive connection instead of paying for a new handshake. in_use is
+        the number of connections currently checked out of the pool.
+        """
+        stats = {}
+        seen = set()
+        for adapter in self._adapters.values():
+            if id(adapter) in seen or not hasattr(adapter, 'poolmanager'):
+                continue
+            seen.add(id(adapter))
+
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                name = '{}://{}:{}'.format(pool.scheme, pool.host, pool.port)
+                stats[name] = {
+                    'maxsize': pool.pool.maxsize,
+                    'in_use': pool.pool.maxsize - pool.pool.qsize(),
+                    'connections': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'reused': max(pool.num_requests - pool.num_connections, 0),
+                }
+
+        return stats
+
+    def map(self, calls, max_workers=None):
+        """ Sends several requests concurrently and returns their results in order.
+
+        Each item of calls is a URL to GET, a (method, url) tuple or a
+        (method, url, kwargs) tuple, where kwargs are the keyword arguments of the
+        corresponding call, e.g. ('post', '/things', {'json': {...}}). A request that
+        fails has the exception it raised in its place instead of a value, so one bad
+        item doesn't lose the rest of the batch.
+
+        Headers, including the correlation id, are built on the calling thread. Each
+        worker sends its requests on a copy of the calling thread's session, with the
+        same headers, auth, adapters and other settings.
+        """
+        prepared = []
+        for call in calls:
+            if isinstance(call, str):
+                call = ('get', call)
+            method, url, kwargs = (tuple(call) + ({},))[:3]
+            kwargs = dict(kwargs, headers=self._make_headers(kwargs.get('headers')))
+            prepared.append((method, url, kwargs))
+
+        if not prepared:
+            return []
 
+        session = self.session
+
+        def send(call):
+            self._use_own_session(session)
+            method, url, kwargs = call
+            try:
+                return self._request(method, url, **kwargs)
+            except Exception as e:
+                return e
+
+        max_workers = min(max_workers or self._pool_maxsize, len(prepared))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(send, prepared))
+
+    def paginate(self, url, params=None, items_key='objects', cursor_param='cursor',
+                 prefetch=False, **kwargs):
+        """ Lazily yields the items of every page of a list endpoint.
+
+        Pages are JSON objects with their items under items_key. The next page is found
+        in meta.next or next (a URL, which may be relative), or else in meta.next_cursor
+        or next_cursor, which is sent back as the cursor_param query parameter. Only one
+        page is held at a time, or two with prefetch=True, where the next page is fetched
+        on a background thread, with a copy of the calling thread's session, while the
+        current one is consumed. Other keyword arguments are passed to every get.
+        """
+        # Built on the calling thread, as in map().
+        kwargs['headers'] = self._make_headers(kwargs.get('headers'))
+
+        def fetch(page_url, page_params):
+            return self._request('get', page_url, params=page_params, **dict(kwargs))
+
+        session = self.session
+
+        def fetch_in_background(page_url, page_params):
+            self._use_own_session(session)
+            return fetch(page_url, page_params)
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page_url, page_params = self._make_url(url), params
+            page = fetch(page_url, page_params)
+            while True:
+                next_page = self._get_next_page(page, page_url, page_params, cursor_param)
+                future = None
+                if next_page is not None and executor is not None:
+                    future = executor.submit(fetch_in_background, *next_page)
+
+                yield from page[items_key]
+
+                if next_page is None:
+                    return
+                page_url, page_params = next_page
+                page = future.result() if future is not None else fetch(*next_page)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _get_next_page(self, page, url, params, cursor_param):
+        meta = page.get('meta') or {}
+
+        next_url = meta.get('next') or page.get('next')
+        if next_url:
+            return urljoin(url, next_url), None
+
+        cursor = meta.get('next_cursor') or page.get('next_cursor')
+        if cursor:
+            return url, dict(params or {}, **{cursor_param: cursor})
+
+        return None
+
+    def _make_request(self, method, url, *args, **kwargs):
+        kwargs['headers'] = self._make_headers(kwargs.get('headers'))
+        return self._request(method, url, *args, **kwargs)
+
+    def _request(self, method, url, *args, **kwargs):
         if self._auth and 'auth' not in kwargs:
             kwargs['auth'] = self._auth
 
         if self._timeout and 'timeout' not in kwargs:
             kwargs['timeout'] = self._timeout
 
+        retry_policy = kwargs.pop('retry_policy', None) or self._retry_policy
+        chunk_size = kwargs.pop('chunk_size', self._stream_chunk_size)
+        decode_content = kwargs.pop('decode_content', True)
+        use_cache = kwargs.pop('cache', True) and self._cache is not None
+
+        deadline = kwargs.pop('deadline', None)
+        if deadline is None and self.deadline_getter is not None:
+            deadline = self.deadline_getter()
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+            kwargs['auth'] = DeadlineAuth(kwargs.get('auth'), deadline, self.deadline_header)
+
         url = self._make_url(url)
 
-        response = getattr(self.session, method)(url, *args, **kwargs)
+        if method == 'get' and not kwargs.get('stream'):
+            key = make_request_key(method, url, kwargs) if self._coalesce else None
+            if key is not None:
+                return self._coalesced(
+                    key,
+                    lambda: self._get(url, retry_policy, args, kwargs, use_cache, deadline),
+                    deadline,
+                )
+            return self._get(url, retry_policy, args, kwargs, use_cache, deadline)
+
+        uncompressed = None
+        if self._compression is not None and method in ('post', 'put', 'patch'):
+            uncompressed = self._encode_body(url, kwargs)
+
+        response = self._fetch(method, url, retry_policy, args, kwargs, deadline)
+
+        if uncompressed is not None and response.status_code == 415:
+            # The service doesn't take compressed bodies: stop sending them and resend.
+            host = urlparse(url).netloc
+            logger.warning('{} rejected a compressed body, sending it uncompressed'.format(host))
+            self.collector.increment('request.compression.rejected', tags={'host': host})
+            self._uncompressed_hosts.add(host)
+            response.close()
+
+            kwargs['data'] = uncompressed
+            del kwargs['headers']['Content-Encoding']
+            response = self._fetch(method, url, retry_policy, args, kwargs, deadline)
+
+        if kwargs.get('stream'):
+            return self._handle_stream(response, chunk_size, decode_content)
+
+        return self._handle_response(response)
+
+    def _encode_body(self, url, kwargs):
+        """ Serializes a json body and compresses it if it's large enough. Returns the
+        uncompressed body if it was compressed.
+        """
+        if kwargs.get('json') is None or kwargs.get('data') is not None:
+            return None
+
+        body = serialization.dumps(kwargs.pop('json'))
+        kwargs['data'] = body
+        headers = kwargs['headers'] = dict(kwargs['headers'])
+        header_names = {name.lower() for name in headers}
+        if 'content-type' not in header_names:
+            headers['Content-Type'] = 'application/json'
+
+        if (len(body) < self._compression_threshold or 'content-encoding' in header_names
+                or urlparse(url).netloc in self._uncompressed_hosts):
+            return None
+
+        kwargs['data'] = compress(body, self._compression, self._compression_level)
+        headers['Content-Encoding'] = self._compression
+        return body
+
+    def _coalesced(self, key, call, deadline=None):
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            self.stats['coalesced'] += 1
+            self.collector.increment('request.coalesced')
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                return self._get_shared_result(*future.result(timeout=timeout))
+            except FutureTimeoutError:
+                raise DeadlineExceeded('Deadline passed while waiting for a coalesced request')
+            except DeadlineExceeded:
+                # The request ran out of its caller's deadline, which may be shorter
+                # than ours.
+                return call()
 
         try:
-            response.raise_for_status()
-        except: # noqa
-            msg = '{} Bad Response: {}'.format(response.status_code, response.content)
-            logger.error(msg)
+            result = call()
+        except BaseException as e:
+            future.set_exception(e)
             raise
+        else:
+            # Readers can only be read once, so callers share the body instead and each
+            # get a reader of their own.
+            is_body = isinstance(result, BufferedReader)
+            if is_body:
+                result = result.read()
+            future.set_result((result, is_body))
+            return self._get_shared_result(result, is_body)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
 
-        try:
-            if self._post_process_response is not None:
-                data = self._post_process_response(response.json())
-            else:
-                data = response.json()
-        except: # noqa
-            if response.headers.get('content-length') == '0':
-                data = None
-            else:
-                data = BufferedReader(BytesIO(response.content))
+    def _get_shared_result(self, result, is_body):
+        return BufferedReader(BytesIO(result)) if is_body else result
+
+    def _get(self, url, retry_policy, args, kwargs, use_cache, deadline):
+        if use_cache:
+            return self._cached_get(url, retry_policy, args, kwargs, deadline)
+        return self._handle_response(
+            self._fetch('get', url, retry_policy, args, kwargs, deadline)
+        )
+
+    def _cached_get(self, url, retry_policy, args, kwargs, deadline):
+        key = self._cache.make_key(url, kwargs)
+        if key is None:
+            return self._handle_response(
+                self._fetch('get', url, retry_policy, args, kwargs, deadline)
+            )
+
+        entry, fresh = self._cache.get(key)
+        if fresh:
+            return entry['data']
+
+        if entry is not None:
+            conditional_headers = self._cache.get_conditional_headers(entry)
+            kwargs['headers'] = dict(kwargs['headers'], **conditional_headers)
+
+        response = self._fetch('get', url, retry_policy, args, kwargs, deadline)
+        if entry is not None and response.status_code == 304:
+            return self._cache.revalidate(key, entry, response)
 
+        data = self._handle_response(response)
+        self._cache.store(key, response, data)
         return data
 
+    def _fetch(self, method, url, retry_policy, args, kwargs, deadline=None):
+        response = self._send(method, url, retry_policy, args, kwargs, deadline)
+
+        auth = kwargs.get('auth')
+        if (response.status_code == 401 and self._can_invalidate(auth)
+                and self._is_replayable(kwargs)):
+            # The token may have been revoked or rotated: swap it for a fresh one and
+            # try once more.
+            logger.warning('{} {} was rejected with a 401, replaying with a new token'.format(
+                method.upper(), url,
+            ))
+            self.collector.increment('request.auth_replay', tags={'method': method})
+            auth.invalidate(response.request.headers.get('Authorization'))
+            response.close()
+            response = self._send(method, url, retry_policy, args, kwargs, deadline)
+
+        return response
+
+    def _get_budget(self, retry_policy, deadline):
+        budget = retry_policy.total_timeout or self._timeout
+        if isinstance(budget, tuple):
+            # An attempt can spend its full connect and read timeouts.
+            budget = sum(part or 0 for part in budget)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            budget = min(budget, remaining) if budget else remaining
+        return budget
+
+    def _send(self, method, url, retry_policy, args, kwargs, deadline=None):
+        if not self._is_replayable(kwargs):
+            # A file or iterator body has been consumed by the first attempt.
+            retry_policy = NO_RETRY
+        attempts = 0
+
+        def count_attempt(attempt):
+            nonlocal attempts
+            attempts = attempt
+
+        def send():
+            attempt_kwargs = kwargs
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded('Deadline passed before the request was sent')
+                attempt_kwargs = dict(
+                    kwargs, timeout=cap_timeout(kwargs.get('timeout'), remaining)
+                )
+
+            try:
+                return self._send_attempt(method, url, args, attempt_kwargs)
+            except requests.Timeout as e:
+                if deadline is None or time.monotonic() < deadline:
+                    raise
+                raise DeadlineExceeded('Deadline passed while waiting for {}'.format(url)) from e
+
+        if self._circuit_breaker is not None:
+            parsed = urlparse(url)
+            host = '{}://{}'.format(parsed.scheme, parsed.netloc)
+            send = partial(self._circuit_breaker.call, host, send)
+
+        try:
+            return retry_policy.call(
+                method,
+                send,
+                budget=self._get_budget(retry_policy, deadline),
+                on_attempt=count_attempt,
+            )
+        finally:
+            self.collector.histogram('request.attempts', attempts, tags={'method': method})
+            if attempts > 1:
+                self.collector.increment(
+                    'request.retries', value=attempts - 1, tags={'method': method}
+                )
+
+    def _send_attempt(self, method, url, args, kwargs):
+        if not self._instrument:
+            return getattr(self.session, method)(url, *args, **kwargs)
+
+        route = self._route_templates.get_route(url)
+        tags = {'host': urlparse(url).netloc, 'method': method, 'route': route}
+        auth = kwargs.get('auth')
+        if auth is not None:
+            auth = TimedAuth(auth)
+        # Hooks may add headers, e.g. to propagate a trace context.
+        kwargs = dict(kwargs, auth=auth, headers=dict(kwargs.get('headers') or {}))
+        contexts = []
+        for hook in self._hooks:
+            try:
+                context = hook.on_request(method, url, kwargs['headers'], route)
+            except Exception:
+                logger.exception('Request hook {!r} failed'.format(hook))
+                context = None
+            contexts.append((hook, context))
+
+        start = time.monotonic()
+        response = error = None
+        try:
+            response = getattr(self.session, method)(url, *args, **kwargs)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_attempt(
+                tags, time.monotonic() - start, auth, response, kwargs.get('stream')
+            )
+            for hook, context in contexts:
+                try:
+                    hook.on_response(context, response=response, error=error)
+                except Exception:
+                    logger.exception('Request hook {!r} failed'.format(hook))
+
+    def _record_attempt(self, tags, duration, auth, response, stream):
+        tags = dict(tags, status=get_status_class(response))
+
+        auth_duration = getattr(auth, 'duration', None) or 0
+        if auth is not None:
+            self.collector.timing('request.auth.time', auth_duration * 1000, tags=tags)
+        self.collector.timing('request.time', (duration - auth_duration) * 1000, tags=tags)
+
+        if response is None:
+            return
+
+        body = response.request.body if response.request is not None else None
+        if isinstance(body, (bytes, str)):
+            self.collector.histogram('request.bytes_sent', len(body), tags=tags)
+
+        received = response.headers.get('Content-Length')
+        if received is None and not stream:
+            received = len(response.content)
+        if received is not None:
+            self.collector.histogram('request.bytes_received', int(received), tags=tags)
+
+    def report_pool_stats(self):
+        """ Sends pool_stats() to the collector as gauges tagged with the host, e.g. to be
+        called periodically to keep an eye on connection reuse.
+        """
+        for host, stats in self.pool_stats().items():
+            for name, value in stats.items():
+                self.collector.gauge('pool.{}'.format(name), value, tags={'host': host})
+
+    def _can_invalidate(self, auth):
+        while isinstance(auth, AuthWrapper):
+            auth = auth.auth
+        return hasattr(auth, 'invalidate')
+
+    def _is_replayable(self, kwargs):
+        data = kwargs.get('data')
+        return not (hasattr(data, 'read') or hasattr(data, '__next__') or kwargs.get('files'))
+
+    def _handle_stream(self, response, chunk_size, decode_content):
+        self._raise_for_status(response)
+
+        return ResponseStream(response, chunk_size=chunk_size, decode_content=decode_content)
+
     def get(self, *args, **kwargs):
         return self._make_request('get', *args, **kwargs)
 
@@ -2,6 +2,7 @@ import logging
 import urllib
 import uuid
 from collections import defaultdict
+from contextlib import contextmanager
 from copy import copy
 from dataclasses import dataclass, field
 from typing import Callable, Dict, List, Optional, Set, Union, cast, overload
@@ -109,9 +110,10 @@ class OSCoreServiceClient:
         parsed = urllib.parse.urlparse(self.client._api_url)
         self.client._api_url = f"{parsed.scheme}://{parsed.netloc}"
 
-    def _make_get_request(self, *args, **kwargs):
+    @contextmanager
+    def _translate_errors(self):
         try:
-            return self.client.get(*args, **kwargs)
+            yield
         except requests.exceptions.HTTPError as e:
             response = getattr(e, "response", None)
             if response is not None and response.status_code // 100 == 4:
@@ -120,6 +122,14 @@ class OSCoreServiceClient:
         except Exception as e:
             raise ServerError("Server error") from e
 
+    def _make_get_request(self, *args, **kwargs):
+        with self._translate_errors():
+            return self.client.get(*args, **kwargs)
+
+    def _fetch_objects(self, url: str, params: Optional[dict] = None) -> List[str]:
+        with self._translate_errors():
+            return list(self.client.paginate(url, params=params))
+
     def fetch_permissions(
         self, person_id: UUIDType, org_ref: UUIDType
     ) -> FetchedPermissionsDoc:
@@ -163,19 +173,17 @@ class OSCoreServiceClient:
             f"Fetching all orgs for which Person {person_id} has permission '{scope}'"
         )
 
-        return self._make_get_request(
-            f"/api/v1/people/{person_id}/permissions/{scope}/orgs"
-        )["objects"]
+        return self._fetch_objects(f"/api/v1/people/{person_id}/permissions/{scope}/orgs")
 
     def fetch_persons_with_permission(self, scope: str, org_ref: UUIDType) -> List[str]:
         logger.debug(
             f"Fetching all persons with permission '{scope}' in org {org_ref}"
         )
 
-        return self._make_get_request(
-            f"/api/v1/permissions/people/by-org-ref",
+        return self._fetch_objects(
+            "/api/v1/permissions/people/by-org-ref",
             params={'scope': scope, 'org_ref': org_ref}
-        )["objects"]
+        )
 
     def fetch_persons_with_permission_for_location(
         self, scope: str, location_type: RefType, location_id: int
@@ -185,10 +193,10 @@ class OSCoreServiceClient:
             "{location_id}, {location_type}"
         )
 
-        return self._make_get_request(
-            f"/api/v1/permissions/people/by-location",
+        return self._fetch_objects(
+            "/api/v1/permissions/people/by-location",
             params={'scope': scope, 'location_type': location_type, 'location_id': location_id}
-        )["objects"]
+        )
 
 
 class Registrar:
@@ -1,8 +1,13 @@
+import json
 from copy import deepcopy
 from typing import Dict, List, Union
 from unittest import TestCase
 from unittest.mock import MagicMock, Mock
 
+import requests
+
+from mbq.client import ServiceClient
+
 from .. import permissions as sut
 
 
@@ -454,3 +459,45 @@ class PermissionsClientTest(TestCase):
         test_example_fn.assert_any_call(
             "person_id", "scope", result=res
         )
+
+
+class OSCoreServiceClientTest(TestCase):
+    def setUp(self):
+        self.service_client = ServiceClient("https://os-core.example.com/api/v1")
+        self.get = Mock()
+        self.service_client.session.get = self.get
+        self.os_core = sut.OSCoreServiceClient(self.service_client)
+
+    def response(self, status_code, body):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    def test_fetch_persons_with_permission_follows_pages(self):
+        self.get.side_effect = [
+            self.response(200, {
+                "meta": {"next": "/api/v1/permissions/people/by-org-ref?offset=2"},
+                "objects": ["person-1", "person-2"],
+            }),
+            self.response(200, {"meta": {"next": None}, "objects": ["person-3"]}),
+        ]
+
+        self.assertEqual(
+            ["person-1", "person-2", "person-3"],
+            self.os_core.fetch_persons_with_permission("read:messages", "org-ref"),
+        )
+        self.assertEqual(
+            "https://os-core.example.com/api/v1/permissions/people/by-org-ref?offset=2",
+            self.get.call_args_list[1][0][0],
+        )
+
+    def test_fetch_org_refs_for_permission_errors(self):
+        self.get.return_value = self.response(404, {})
+        with self.assertRaises(sut.ClientError):
+            self.os_core.fetch_org_refs_for_permission("person", "read:messages")
+
+        self.get.return_value = self.response(500, {})
+        with self.assertRaises(sut.ServerError):
+            self.os_core.fetch_org_refs_for_permission("person", "read:messages")
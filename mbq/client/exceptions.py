@@ -0,0 +1,9 @@
+import requests
+
+
+class CircuitOpenError(requests.RequestException):
+    """ Raised instead of sending a request to a host whose circuit breaker is open. """
+
+
+class DeadlineExceeded(requests.Timeout):
+    """ Raised when a call's deadline passes before it could complete. """
@@ -0,0 +1,65 @@
+import re
+from urllib.parse import urlparse
+
+
+# Path segments that identify a single resource, and would make a tag per object.
+ID_SEGMENT = re.compile(
+    r'^(\d+|[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}|[0-9a-f]{24,})$',
+    re.IGNORECASE,
+)
+
+
+class RequestHook:
+    """ Interface for tracing integrations, e.g. to wrap each request in a span.
+
+    on_request is called before every attempt at a request is sent, with the headers
+    it will be sent with (which it may modify, e.g. to propagate a trace context) and
+    the route template of its URL. Whatever it returns is passed back to on_response
+    together with the response, or the error if none was received. Hooks that raise
+    are logged and don't fail the request; on_response gets a None context when
+    on_request raised.
+    """
+
+    def on_request(self, method, url, headers, route):
+        return None
+
+    def on_response(self, context, response=None, error=None):
+        pass
+
+
+class RouteTemplates:
+    """ Turns URLs into route templates to use as metric tags, so that tags don't get
+    a value per object.
+
+    templates are paths with {placeholders}, e.g. '/api/v1/people/{person_id}/roles'.
+    Paths that match none of them have their numeric, UUID and hex ID segments replaced
+    with {id}.
+    """
+
+    def __init__(self, templates=None):
+        self._templates = [
+            (self._compile(template), template) for template in (templates or [])
+        ]
+
+    def _compile(self, template):
+        parts = re.split(r'({[^}/]*})', template)
+        pattern = ''.join(
+            '[^/]+' if part.startswith('{') else re.escape(part) for part in parts
+        )
+        return re.compile('^{}/?$'.format(pattern))
+
+    def get_route(self, url):
+        path = urlparse(url).path or '/'
+        for pattern, template in self._templates:
+            if pattern.match(path):
+                return template
+
+        return '/'.join(
+            '{id}' if ID_SEGMENT.match(segment) else segment for segment in path.split('/')
+        )
+
+
+def get_status_class(response):
+    if response is None:
+        return 'error'
+    return '{}xx'.format(response.status_code // 100)
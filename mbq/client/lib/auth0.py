@@ -1,15 +1,82 @@
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
 
+from ..exceptions import DeadlineExceeded
+from ..retry import RetryPolicy
+from .deadlines import cap_timeout, get_remaining
 
-def get_access_token(audience, client_id, client_secret, domain):
-    response = requests.post(
-        'https://{}/oauth/token'.format(domain),
-        json={
-            'grant_type': 'client_credentials',
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'audience': audience,
-        }
-    )
+
+# Connect and read timeouts, in seconds.
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Client credentials grants have no side effects, so they're safe to retry.
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    max_attempts=3,
+    methods=['post'],
+    status_codes=[429, 500, 502, 503, 504],
+    backoff_factor=0.5,
+    total_timeout=30,
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """ Returns the session shared by all token requests, so that connections to
+    Auth0 are kept alive between fetches.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_maxsize=10))
+                _session = session
+    return _session
+
+
+def fetch_access_token(audience, client_id, client_secret, domain, timeout=DEFAULT_TIMEOUT,
+                       retry_policy=DEFAULT_RETRY_POLICY):
+    """ Requests a client credentials grant and returns Auth0's full token response,
+    including access_token and expires_in.
+
+    Within a deadline_scope, attempts and retries are cut short to fit in the time
+    left, and DeadlineExceeded is raised once it has run out.
+    """
+    url = 'https://{}/oauth/token'.format(domain)
+    payload = {
+        'grant_type': 'client_credentials',
+        'client_id': client_id,
+        'client_secret': client_secret,
+        'audience': audience,
+    }
+
+    def send():
+        attempt_timeout = timeout
+        remaining = get_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded('Deadline passed before a token was fetched')
+            attempt_timeout = cap_timeout(timeout, remaining)
+
+        try:
+            return get_session().post(url, json=payload, timeout=attempt_timeout)
+        except requests.Timeout as e:
+            remaining = get_remaining()
+            if remaining is None or remaining > 0:
+                raise
+            raise DeadlineExceeded('Deadline passed while fetching a token') from e
+
+    budget = get_remaining()
+    if budget is not None and retry_policy.total_timeout:
+        budget = min(budget, retry_policy.total_timeout)
+    response = retry_policy.call('post', send, budget=budget)
     response.raise_for_status()
-    return response.json().get('access_token')
+    return response.json()
+
+
+def get_access_token(audience, client_id, client_secret, domain):
+    return fetch_access_token(audience, client_id, client_secret, domain).get('access_token')
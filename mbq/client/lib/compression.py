@@ -0,0 +1,27 @@
+import gzip
+
+
+# Levels that trade a little ratio for much faster compression than the maximum,
+# as bodies are compressed on every request.
+DEFAULT_LEVELS = {'gzip': 6, 'br': 4}
+
+
+def check_encoding(encoding):
+    """ Raises if bodies can't be compressed with encoding here. """
+    if encoding == 'br':
+        import brotli  # noqa: F401
+    elif encoding != 'gzip':
+        raise ValueError('Unsupported request compression: {}'.format(encoding))
+
+
+def compress(data, encoding, level=None):
+    """ Compresses bytes with the given Content-Encoding, gzip or br (which needs the
+    brotli package).
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level)
@@ -0,0 +1,39 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+_local = threading.local()
+
+
+def cap_timeout(timeout, limit):
+    """ Returns timeout, a number of seconds or a (connect, read) tuple as accepted by
+    requests, with no part longer than limit.
+    """
+    if isinstance(timeout, tuple):
+        return tuple(limit if part is None else min(part, limit) for part in timeout)
+    return limit if timeout is None else min(timeout, limit)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """ Makes deadline, a time.monotonic() value, the deadline of work done on the
+    current thread until the block exits, e.g. fetching the token for a request. A
+    nested scope can only bring the deadline forward.
+    """
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def get_remaining():
+    """ Returns the number of seconds left until the current thread's deadline, or None
+    outside of a deadline_scope.
+    """
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+
+
+class NullCollector:
+    """ Stands in for an mbq.metrics.Collector when a component isn't given one,
+    so instrumented code doesn't have to check before every call.
+    """
+
+    def gauge(self, metric, value, tags=None):
+        pass
+
+    def increment(self, metric, value=1, tags=None):
+        pass
+
+    def histogram(self, metric, value, tags=None, sample_rate=1):
+        pass
+
+    def timing(self, metric, value, tags=None):
+        pass
+
+    @contextmanager
+    def timed(self, metric, tags=None, use_ms=True):
+        yield
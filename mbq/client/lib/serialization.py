@@ -0,0 +1,24 @@
+import json
+
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def loads(data):
+    """ Parses a JSON document from str or UTF-8 encoded bytes, using orjson when it
+    is installed.
+    """
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """ Serializes obj to UTF-8 encoded JSON bytes, using orjson when it is installed. """
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode('utf-8')
@@ -0,0 +1,109 @@
+import logging
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+from .authenticator import AsyncAuthenticator
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRegistry:
+    """ Process-wide source of authenticators for every service a TokenManager knows about.
+
+    Authenticators are created once per service and shared, so every ServiceClient
+    talking to a service reuses the same cached token and Authorization header. They are
+    AsyncAuthenticators, so they work with both ServiceClient and AsyncServiceClient.
+
+    The registry can also be passed as a ServiceClient's auth directly, in which case
+    the audience of each request is resolved from its URL. routes maps either hosts
+    ('os-core.example.com') or URL prefixes ('https://api.example.com/os-core/') to
+    service names; the longest matching prefix wins, then the host. Hosts that aren't
+    routed fall back to a service named after the host or its first label
+    (os-core.internal -> os-core), as long as the token manager has an audience for it.
+    """
+
+    def __init__(self, token_manager, routes=None):
+        self.token_manager = token_manager
+        self._prefix_routes = []
+        self._host_routes = {}
+        self._authenticators = {}
+        self._authorizations = {}
+        self._lock = threading.Lock()
+
+        for route, service_name in (routes or {}).items():
+            self.add_route(route, service_name)
+
+    def add_route(self, route, service_name):
+        if '://' in route:
+            self._prefix_routes.append((route, service_name))
+            self._prefix_routes.sort(key=lambda item: len(item[0]), reverse=True)
+        else:
+            self._host_routes[route.lower()] = service_name
+
+    def get_service_name(self, url):
+        """ Returns the service whose token should be sent to url. """
+        for prefix, service_name in self._prefix_routes:
+            if url.startswith(prefix):
+                return service_name
+
+        parsed = urlparse(url)
+        netloc, hostname = parsed.netloc.lower(), parsed.hostname or ''
+        for host in (netloc, hostname):
+            if host in self._host_routes:
+                return self._host_routes[host]
+
+        api_ids = self.token_manager.settings['api_ids']
+        for service_name in (hostname, hostname.split('.')[0]):
+            if service_name in api_ids:
+                return service_name
+
+        raise ValueError('No service is routed to {}'.format(url))
+
+    def get_authenticator(self, service_name):
+        authenticator = self._authenticators.get(service_name)
+        if authenticator is None:
+            with self._lock:
+                authenticator = self._authenticators.setdefault(
+                    service_name, AsyncAuthenticator(service_name, self.token_manager)
+                )
+        return authenticator
+
+    def get_authenticator_for_url(self, url):
+        return self.get_authenticator(self.get_service_name(url))
+
+    def __call__(self, request):
+        service_name = self.get_service_name(request.url)
+        authorization = self.get_authenticator(service_name).get_authorization()
+        self._authorizations[service_name] = authorization
+        request.headers['Authorization'] = authorization
+        return request
+
+    def invalidate(self, authorization=None):
+        """ Replaces the token behind an Authorization header this registry sent, for
+        ServiceClient's replay of requests rejected with a 401.
+        """
+        for service_name, sent in list(self._authorizations.items()):
+            if sent == authorization:
+                self.get_authenticator(service_name).invalidate(authorization)
+                return
+
+        logger.warning('Cannot invalidate a token this registry did not send')
+
+    def prefetch(self, service_names=None, max_workers=8):
+        """ Loads tokens for service_names, by default every configured service, in one
+        batch. Meant to be called at startup so first requests don't wait on Auth0.
+        """
+        tokens = self.token_manager.prefetch_tokens(service_names, max_workers=max_workers)
+        for service_name in tokens:
+            self.get_authenticator(service_name)
+        return tokens
+
+    def stats(self):
+        """ Token and header cache counters for every service, in one place. """
+        stats = Counter(self.token_manager.stats)
+        for authenticator in list(self._authenticators.values()):
+            stats.update(authenticator.stats)
+        stats['authenticators'] = len(self._authenticators)
+        return dict(stats)
@@ -0,0 +1,118 @@
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from .exceptions import DeadlineExceeded
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """ Decides whether a failed request is retried and how long to wait before doing so.
+
+    Only requests whose method is in `methods` are retried, so by default a POST or PATCH
+    is never sent twice. Connection errors and timeouts are retried, as are responses
+    whose status is in `status_codes`. The wait before attempt n is drawn uniformly from
+    [0, min(max_backoff, backoff_factor * 2 ** n)] ("full jitter") so that clients that
+    failed together don't retry together, unless the response carries a Retry-After
+    header, which takes precedence. No retry is made if its wait would overrun the
+    request's time budget, or if Retry-After asks for a longer wait than max_backoff.
+    """
+
+    DEFAULT_METHODS = frozenset(['get', 'head', 'options', 'put', 'delete'])
+    DEFAULT_STATUS_CODES = frozenset([429, 502, 503, 504])
+
+    def __init__(self, max_attempts=3, methods=DEFAULT_METHODS,
+                 status_codes=DEFAULT_STATUS_CODES, backoff_factor=0.1, max_backoff=10.0,
+                 respect_retry_after=True, total_timeout=None):
+        self.max_attempts = max_attempts
+        self.methods = frozenset(method.lower() for method in methods)
+        self.status_codes = frozenset(status_codes)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.respect_retry_after = respect_retry_after
+        self.total_timeout = total_timeout
+
+    def is_retryable(self, method, response=None, error=None):
+        if method.lower() not in self.methods:
+            return False
+
+        if error is not None:
+            return (isinstance(error, (requests.ConnectionError, requests.Timeout))
+                    and not isinstance(error, DeadlineExceeded))
+
+        return response is not None and response.status_code in self.status_codes
+
+    def get_backoff(self, attempt, response=None):
+        """ Returns the number of seconds to wait after the given (1-based) attempt, or
+        None if the response's Retry-After is longer than max_backoff and it shouldn't be
+        retried at all.
+        """
+        if self.respect_retry_after and response is not None:
+            retry_after = self._parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_backoff else None
+
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def _parse_retry_after(self, value):
+        if not value:
+            return None
+
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def call(self, method, send, budget=None, on_attempt=None):
+        """ Calls send() until it returns a non-retryable response, raises a non-retryable
+        error, or attempts or the time budget (in seconds) run out.
+
+        on_attempt is called with the attempt number before each attempt is made.
+        """
+        if budget is None:
+            budget = self.total_timeout
+        deadline = time.monotonic() + budget if budget else None
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if on_attempt is not None:
+                on_attempt(attempt)
+
+            response = error = None
+            try:
+                response = send()
+            except requests.RequestException as e:
+                error = e
+
+            if attempt >= self.max_attempts or not self.is_retryable(method, response, error):
+                break
+
+            delay = self.get_backoff(attempt, response)
+            if delay is None or (deadline is not None and time.monotonic() + delay >= deadline):
+                break
+
+            logger.info('Retrying {} request in {:.2f}s (attempt {} of {}): {}'.format(
+                method.upper(), delay, attempt + 1, self.max_attempts,
+                error or response.status_code,
+            ))
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return response
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
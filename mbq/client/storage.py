@@ -1,39 +1,249 @@
 import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+from typing_extensions import Protocol
+
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+
+class Storage(Protocol):
+    """ Interface TokenManager expects of its storage backend. timeout is the number of
+    seconds until a key expires; None means the backend's default.
+
+    Only get and set are required: TokenManager makes one call per key on backends
+    without get_many and set_many, and leaves the timeout out for a set() without one.
+    """
+
+    def get(self, key: str) -> Any:
+        ...
+
+    def set(self, key: str, value: Any, timeout: Optional[float] = None) -> None:
+        ...
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        ...
+
+    def set_many(self, mapping: Dict[str, Any], timeout: Optional[float] = None) -> None:
+        ...
+
+    def delete(self, key: str) -> None:
+        ...
 
 
 class DjangoCacheStorage(object):
+    """ Stores tokens in a Django cache. timeout is used for keys set without one. """
 
     def __init__(self, cache, timeout=None):
         self.cache = cache
         self.timeout = timeout
 
-    def set(self, key, value):
-        self.cache.set(key, value, timeout=self.timeout)
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, timeout=self.timeout if timeout is None else timeout)
 
     def get(self, key):
         return self.cache.get(key)
 
+    def set_many(self, mapping, timeout=None):
+        self.cache.set_many(mapping, timeout=self.timeout if timeout is None else timeout)
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def add(self, key, value, timeout=None):
+        """ Sets key only if it isn't already set and returns whether it was set. """
+        return self.cache.add(key, value, timeout=timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
 
 class FileStorage(object):
+    """ Stores tokens in a JSON file that several processes can share.
+
+    Reads are served from an in-memory copy of the file, which is only reloaded
+    when the file has been replaced since it was last read. Writes take an exclusive
+    lock on a sidecar .lock file (where fcntl is available), merge into the current
+    contents of the file and atomically replace it, so readers never see a partial
+    file and concurrent writers don't drop each other's keys.
+
+    Expiry times of keys set with a timeout are kept under the reserved key
+    '__expires_at__'.
+    """
+
+    _expiry_key = '__expires_at__'
 
     def __init__(self, filename):
         self.filename = filename
+        self._lock_filename = '{}.lock'.format(filename)
+        self._thread_lock = threading.Lock()
+        self._tokens = {}
+        self._signature = None
         open(self.filename, 'a').close()
 
+    def _get_signature(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
     def _get_tokens_from_file(self):
-        with open(self.filename, 'r') as f:
+        signature = self._get_signature()
+        if signature != self._signature:
             try:
-                return json.load(f)
-            except ValueError:
-                return {}
+                with open(self.filename, 'r') as f:
+                    tokens = json.load(f)
+            except (FileNotFoundError, ValueError):
+                tokens = {}
+            self._tokens, self._signature = tokens, signature
+
+        return self._tokens
+
+    @contextmanager
+    def _write_lock(self):
+        with self._thread_lock:
+            if not HAS_FCNTL:
+                yield
+                return
+
+            with open(self._lock_filename, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_tokens_to_file(self, tokens):
+        directory, basename = os.path.split(os.path.abspath(self.filename))
+        fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(basename))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
 
-    def set(self, key, value):
+        self._tokens, self._signature = tokens, self._get_signature()
+
+    def _update(self, values, timeout=None, deleted=()):
+        with self._write_lock():
+            tokens = dict(self._get_tokens_from_file())
+            expiries = dict(tokens.get(self._expiry_key, {}))
+
+            now = time.time()
+            for key, expires_at in list(expiries.items()):
+                if expires_at <= now:
+                    tokens.pop(key, None)
+                    del expiries[key]
+
+            for key in deleted:
+                tokens.pop(key, None)
+                expiries.pop(key, None)
+
+            for key, value in values.items():
+                tokens[key] = value
+                if timeout is None:
+                    expiries.pop(key, None)
+                else:
+                    expiries[key] = now + timeout
+
+            tokens[self._expiry_key] = expiries
+            self._write_tokens_to_file(tokens)
+
+    def set(self, key, value, timeout=None):
+        self._update({key: value}, timeout=timeout)
+
+    def set_many(self, mapping, timeout=None):
+        self._update(mapping, timeout=timeout)
+
+    def delete(self, key):
+        self._update({}, deleted=[key])
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
         tokens = self._get_tokens_from_file()
+        expiries = tokens.get(self._expiry_key, {})
+        now = time.time()
+
+        values = {}
+        for key in keys:
+            if key not in tokens or key == self._expiry_key:
+                continue
+            expires_at = expiries.get(key)
+            if expires_at is None or expires_at > now:
+                values[key] = tokens[key]
 
-        tokens[key] = value
+        return values
 
-        with open(self.filename, 'w') as f:
-            json.dump(tokens, f)
+
+class SQLiteStorage(object):
+    """ Stores tokens in a SQLite database, for processes on one host that share
+    tokens without a cache server. SQLite takes care of locking between processes.
+    """
+
+    def __init__(self, filename, timeout=10):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tokens '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+            )
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def set(self, key, value, timeout=None):
+        self.set_many({key: value}, timeout=timeout)
+
+    def set_many(self, mapping, timeout=None):
+        expires_at = None if timeout is None else time.time() + timeout
+        with self._connection() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO tokens (key, value, expires_at) VALUES (?, ?, ?)',
+                [(key, json.dumps(value), expires_at) for key, value in mapping.items()],
+            )
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM tokens WHERE key = ?', (key,))
 
     def get(self, key):
-        return self._get_tokens_from_file().get(key)
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        rows = self._connection().execute(
+            'SELECT key, value FROM tokens WHERE key IN ({}) '
+            'AND (expires_at IS NULL OR expires_at > ?)'.format(', '.join('?' * len(keys))),
+            keys + [time.time()],
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
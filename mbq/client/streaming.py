@@ -0,0 +1,54 @@
+import io
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseStream(io.RawIOBase):
+    """ Read-only file object over the body of a streamed response.
+
+    Data is read straight off the socket as it is consumed instead of being buffered
+    in memory first. With decode_content=True, gzip and deflate encoded bodies are
+    decompressed on the fly; otherwise the raw bytes are returned. The connection goes
+    back to the pool once the body has been read to the end, and is dropped if the
+    stream is closed early, so always close it (or use it as a context manager).
+    """
+
+    def __init__(self, response, chunk_size=DEFAULT_CHUNK_SIZE, decode_content=True):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.chunk_size = chunk_size
+        self.decode_content = decode_content
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        if not self._buffer:
+            # Decompression can produce more than we asked for, hence the buffer.
+            self._buffer = self.response.raw.read(size, decode_content=self.decode_content)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        b[:len(data)] = data
+        return len(data)
+
+    def iter_chunks(self, chunk_size=None):
+        """ Yields the body in chunks of up to chunk_size bytes and closes the stream. """
+        try:
+            if self._buffer:
+                yield self._buffer
+                self._buffer = b''
+            for chunk in self.response.raw.stream(
+                chunk_size or self.chunk_size, decode_content=self.decode_content
+            ):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.response.close()
+        super().close()
@@ -0,0 +1,102 @@
+import asyncio
+from io import BufferedReader
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from mbq.client.async_client import AsyncServiceClient
+from mbq.client.authenticator import AsyncAuthenticator
+from mbq.client.tests.test_client import make_response
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeTransport:
+
+    def __init__(self, response=None):
+        self.response = response or make_response()
+        self.calls = []
+        self.closed = False
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return self.response
+
+    async def aclose(self):
+        self.closed = True
+
+
+class AsyncServiceClientTestCase(TestCase):
+
+    def test_request(self):
+        transport = FakeTransport(make_response(content=b'{"id": 1}'))
+        client = AsyncServiceClient(
+            'https://foo.com',
+            headers={'Test-Service-Header': 'service-header-value'},
+            correlation_id_getter=lambda: 'hello-world',
+            transport=transport,
+        )
+
+        data = run(client.get('/url', params={'a': 1}, headers={'Test-Get-Header': 'value'}))
+
+        self.assertEqual({'id': 1}, data)
+        method, url, kwargs = transport.calls[0]
+        self.assertEqual('GET', method)
+        self.assertEqual('https://foo.com/url', url)
+        self.assertEqual({'a': 1}, kwargs['params'])
+        self.assertEqual(30, kwargs['timeout'])
+        self.assertEqual({
+            'Test-Service-Header': 'service-header-value',
+            'Test-Get-Header': 'value',
+            'X-Correlation-Id': 'hello-world',
+        }, kwargs['headers'])
+
+    def test_absolute_url(self):
+        transport = FakeTransport()
+        client = AsyncServiceClient('https://foo.com', transport=transport)
+        run(client.post('https://bar.com/url', json={}))
+        self.assertEqual(('POST', 'https://bar.com/url'), transport.calls[0][:2])
+
+    def test_auth(self):
+        token_manager = MagicMock()
+        token_manager.get_token.return_value = 'token'
+        transport = FakeTransport()
+        client = AsyncServiceClient(
+            'https://foo.com',
+            auth=AsyncAuthenticator('my_service', token_manager),
+            transport=transport,
+        )
+
+        run(client.delete('/url'))
+
+        self.assertEqual('Bearer token', transport.calls[0][2]['headers']['Authorization'])
+        token_manager.get_token.assert_called_once_with(service_name='my_service')
+
+    def test_post_process_and_binary_response(self):
+        transport = FakeTransport(make_response(content=b'{"data": [1, 2]}'))
+        client = AsyncServiceClient(
+            'https://foo.com',
+            post_process_response=lambda data: data['data'],
+            transport=transport,
+        )
+        self.assertEqual([1, 2], run(client.get('/url')))
+
+        transport.response = make_response(content=b'binary', content_type='image/png')
+        data = run(client.get('/url'))
+        self.assertIsInstance(data, BufferedReader)
+        self.assertEqual(b'binary', data.read())
+
+    def test_context_manager_closes_transport(self):
+        transport = FakeTransport()
+
+        async def use_client():
+            async with AsyncServiceClient('https://foo.com', transport=transport) as client:
+                await client.put('/url')
+
+        run(use_client())
+        self.assertTrue(transport.closed)
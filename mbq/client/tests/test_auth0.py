@@ -0,0 +1,108 @@
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from mbq.client.exceptions import DeadlineExceeded
+from mbq.client.lib import auth0
+from mbq.client.lib.deadlines import deadline_scope
+
+
+def make_response(status_code, data=None):
+    response = MagicMock(status_code=status_code, headers={})
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+class Auth0TestCase(TestCase):
+
+    def setUp(self):
+        sleep_patch = patch('mbq.client.retry.time.sleep')
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+        post_patch = patch.object(auth0.get_session(), 'post')
+        self.post = post_patch.start()
+        self.addCleanup(post_patch.stop)
+
+    def test_session_is_shared(self):
+        self.assertIs(auth0.get_session(), auth0.get_session())
+
+    def test_fetch_access_token(self):
+        token_response = {'access_token': 'token', 'expires_in': 86400, 'token_type': 'Bearer'}
+        self.post.return_value = make_response(200, token_response)
+
+        self.assertEqual(
+            token_response,
+            auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com'),
+        )
+        self.post.assert_called_once_with(
+            'https://auth0.com/oauth/token',
+            json={
+                'grant_type': 'client_credentials',
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'audience': 'audience',
+            },
+            timeout=auth0.DEFAULT_TIMEOUT,
+        )
+
+    def test_get_access_token(self):
+        self.post.return_value = make_response(200, {'access_token': 'token'})
+        self.assertEqual(
+            'token', auth0.get_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        )
+
+    def test_retries(self):
+        self.post.side_effect = [
+            requests.ConnectTimeout(),
+            make_response(429),
+            make_response(200, {'access_token': 'token'}),
+        ]
+        self.assertEqual(
+            'token', auth0.get_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        )
+        self.assertEqual(3, self.post.call_count)
+
+    def test_gives_up(self):
+        self.post.return_value = make_response(503)
+        with self.assertRaises(requests.HTTPError):
+            auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        self.assertEqual(auth0.DEFAULT_RETRY_POLICY.max_attempts, self.post.call_count)
+
+        self.post.reset_mock()
+        self.post.return_value = make_response(401)
+        with self.assertRaises(requests.HTTPError):
+            auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        self.assertEqual(1, self.post.call_count)
+
+    def test_deadline(self):
+        self.post.return_value = make_response(200, {'access_token': 'token'})
+        with deadline_scope(time.monotonic() + 2):
+            auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        for part in self.post.call_args[1]['timeout']:
+            self.assertTrue(1.9 < part <= 2)
+
+        def time_out(*args, **kwargs):
+            # time.sleep is patched out.
+            end = time.monotonic() + 0.02
+            while time.monotonic() < end:
+                pass
+            raise requests.ReadTimeout()
+
+        # Timing out at the deadline isn't retried.
+        self.post.reset_mock()
+        self.post.side_effect = time_out
+        with self.assertRaises(DeadlineExceeded):
+            with deadline_scope(time.monotonic() + 0.01):
+                auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        self.assertEqual(1, self.post.call_count)
+
+        self.post.reset_mock()
+        with self.assertRaises(DeadlineExceeded):
+            with deadline_scope(time.monotonic() - 1):
+                auth0.fetch_access_token('audience', 'client_id', 'secret', 'auth0.com')
+        self.post.assert_not_called()
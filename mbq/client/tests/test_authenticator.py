@@ -0,0 +1,62 @@
+import asyncio
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from mbq.client.authenticator import AsyncAuthenticator, Authenticator
+
+
+class AuthenticatorTestCase(TestCase):
+
+    def setUp(self):
+        self.token_manager = MagicMock()
+        self.token_manager.get_token.return_value = 'token'
+        self.token_manager.get_token_version.return_value = 1
+        self.token_manager.get_token_valid_until.return_value = time.time() + 60
+        self.authenticator = Authenticator('my_service', self.token_manager)
+
+    def test_call(self):
+        request = MagicMock(headers={})
+        self.assertIs(request, self.authenticator(request))
+        self.assertEqual('Bearer token', request.headers['Authorization'])
+        self.token_manager.get_token.assert_called_once_with(service_name='my_service')
+
+    def test_invalidate(self):
+        self.authenticator.invalidate('Bearer rejected-token')
+        self.token_manager.invalidate_token.assert_called_once_with(
+            'my_service', 'rejected-token'
+        )
+
+        self.token_manager.reset_mock()
+        self.authenticator.invalidate(None)
+        self.token_manager.invalidate_token.assert_called_once_with('my_service', None)
+
+    def test_header_is_cached(self):
+        self.assertEqual('Bearer token', self.authenticator.get_authorization())
+        self.assertEqual('Bearer token', self.authenticator.get_authorization())
+        self.token_manager.get_token.assert_called_once_with(service_name='my_service')
+        self.token_manager.get_token_valid_until.assert_called_once_with('my_service', 'token')
+
+    def test_header_is_rebuilt_when_token_changes(self):
+        self.authenticator.get_authorization()
+
+        self.token_manager.get_token_version.return_value = 2
+        self.token_manager.get_token.return_value = 'new-token'
+        self.assertEqual('Bearer new-token', self.authenticator.get_authorization())
+        self.assertEqual(2, self.token_manager.get_token.call_count)
+
+    def test_header_is_rebuilt_when_stale(self):
+        self.token_manager.get_token_valid_until.return_value = time.time() - 1
+        self.authenticator.get_authorization()
+        self.authenticator.get_authorization()
+        self.assertEqual(2, self.token_manager.get_token.call_count)
+
+    def test_async_header_is_cached(self):
+        authenticator = AsyncAuthenticator('my_service', self.token_manager)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        for _ in range(2):
+            authorization = loop.run_until_complete(authenticator.get_authorization_async())
+            self.assertEqual('Bearer token', authorization)
+        self.token_manager.get_token.assert_called_once_with(service_name='my_service')
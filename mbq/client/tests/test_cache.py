@@ -0,0 +1,220 @@
+import threading
+import time
+import typing
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from requests.auth import AuthBase, HTTPBasicAuth
+
+from mbq.client.cache import (
+    DjangoCacheBackend,
+    HTTPCache,
+    LRUCacheBackend,
+    get_freshness_lifetime,
+    parse_cache_control,
+)
+from mbq.client.client import ServiceClient
+from mbq.client.lib import serialization
+
+from .test_client import KeepAliveServer
+
+
+class CachingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    requests: typing.Counter[str] = Counter()
+    headers_by_path = {
+        '/max-age': {'Cache-Control': 'max-age=60'},
+        '/no-store': {'Cache-Control': 'no-store, max-age=60'},
+        '/etag': {'Cache-Control': 'no-cache', 'ETag': '"v1"'},
+        '/last-modified': {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+        '/plain': {},
+        '/routed/plain': {},
+        '/routed/never': {'Cache-Control': 'max-age=60'},
+    }
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.requests[self.path] += 1
+
+        headers = dict(self.headers_by_path.get(path, {}))
+        validators = {self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')}
+        if validators & {headers.get('ETag'), headers.get('Last-Modified')} - {None}:
+            status, body = 304, b''
+        else:
+            status = 200
+            body = serialization.dumps({'path': self.path, 'count': self.requests[self.path]})
+            headers['Content-Type'] = 'application/json'
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPCacheTestCase(TestCase):
+
+    def setUp(self):
+        CachingHandler.requests.clear()
+        server = KeepAliveServer(('127.0.0.1', 0), CachingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.cache = HTTPCache(routes={'/routed/': 30, '/routed/never': 0})
+        self.client = ServiceClient(
+            'http://127.0.0.1:{}'.format(server.server_port),
+            cache=self.cache,
+            post_process_response=lambda data: dict(data, processed=True),
+        )
+
+    def test_fresh_responses_are_served_from_cache(self):
+        first = self.client.get('/max-age', params={'a': 1})
+        self.assertIs(first, self.client.get('/max-age', params={'a': 1}))
+        self.assertTrue(first['processed'])
+        self.assertEqual(1, CachingHandler.requests['/max-age?a=1'])
+
+        self.client.get('/max-age', params={'a': 2})
+        self.assertEqual(1, CachingHandler.requests['/max-age?a=2'])
+        self.assertEqual({'miss': 2, 'hit': 1}, self.cache.stats)
+
+    def test_stale_responses_are_refetched(self):
+        self.client.get('/max-age')
+        with patch('mbq.client.cache.time.time', return_value=time.time() + 61):
+            self.client.get('/max-age')
+        self.assertEqual(2, CachingHandler.requests['/max-age'])
+
+    def test_no_store(self):
+        self.client.get('/no-store')
+        self.client.get('/no-store')
+        self.assertEqual(2, CachingHandler.requests['/no-store'])
+
+    def test_etag_revalidation(self):
+        first = self.client.get('/etag')
+        second = self.client.get('/etag')
+        self.assertEqual(first, second)
+        self.assertEqual(1, second['count'])
+        self.assertEqual(2, CachingHandler.requests['/etag'])
+        self.assertEqual(1, self.cache.stats['revalidated'])
+
+    def test_last_modified_revalidation(self):
+        self.client.get('/last-modified')
+        self.assertEqual(1, self.client.get('/last-modified')['count'])
+        self.assertEqual(1, self.cache.stats['revalidated'])
+
+    def test_responses_without_lifetime_are_not_cached(self):
+        self.client.get('/plain')
+        self.client.get('/plain')
+        self.assertEqual(2, CachingHandler.requests['/plain'])
+
+    def test_route_overrides(self):
+        self.client.get('/routed/plain')
+        self.client.get('/routed/plain')
+        self.assertEqual(1, CachingHandler.requests['/routed/plain'])
+
+        self.client.get('/routed/never')
+        self.client.get('/routed/never')
+        self.assertEqual(2, CachingHandler.requests['/routed/never'])
+
+    def test_per_call_opt_out(self):
+        self.client.get('/max-age')
+        self.client.get('/max-age', cache=False)
+        self.assertEqual(2, CachingHandler.requests['/max-age'])
+
+    def test_max_entry_size(self):
+        self.cache.max_entry_size = 10
+        self.client.get('/max-age')
+        self.client.get('/max-age')
+        self.assertEqual(2, CachingHandler.requests['/max-age'])
+
+    def test_key_includes_headers_and_service(self):
+        auth = MagicMock(service_name='os-core')
+        key = self.cache.make_key('https://foo.com/things', {
+            'params': {'b': 2, 'a': 1},
+            'headers': {'Accept': 'application/json', 'X-Correlation-Id': 'cid'},
+            'auth': auth,
+        })
+        self.assertEqual(
+            "GET https://foo.com/things?b=2&a=1 [('accept', 'application/json')] "
+            "service:os-core",
+            key,
+        )
+
+    def test_key_includes_basic_auth_user(self):
+        keys = {
+            self.cache.make_key('https://foo.com/things', {'auth': auth})
+            for auth in [('alice', 'pw'), ('bob', 'pw'), ('alice', 'other'), None]
+        }
+        self.assertEqual(4, len(keys))
+        self.assertEqual(
+            self.cache.make_key('https://foo.com/things', {'auth': ('alice', 'pw')}),
+            self.cache.make_key('https://foo.com/things', {'auth': HTTPBasicAuth('alice', 'pw')}),
+        )
+        key = self.cache.make_key('https://foo.com/things', {'auth': ('alice', 'pw')})
+        self.assertNotIn('pw', key)
+
+    def test_unidentified_auth_is_not_cached(self):
+        self.assertIsNone(self.cache.make_key('https://foo.com/things', {'auth': AuthBase()}))
+
+        self.client.get('/max-age', auth=lambda request: request)
+        self.client.get('/max-age', auth=lambda request: request)
+        self.assertEqual(2, CachingHandler.requests['/max-age'])
+        self.assertEqual({}, self.cache.stats)
+
+
+class HeaderParsingTestCase(TestCase):
+
+    def test_parse_cache_control(self):
+        self.assertEqual(
+            {'max-age': '60', 'no-cache': None, 'private': None},
+            parse_cache_control('max-age="60", No-Cache, private'),
+        )
+        self.assertEqual({}, parse_cache_control(None))
+
+    def test_get_freshness_lifetime(self):
+        self.assertEqual(60, get_freshness_lifetime({'Cache-Control': 'max-age=60'}))
+        self.assertEqual(0, get_freshness_lifetime({'Cache-Control': 'no-cache, max-age=60'}))
+        self.assertEqual(120, get_freshness_lifetime({
+            'Date': 'Wed, 21 Oct 2015 07:28:00 GMT',
+            'Expires': 'Wed, 21 Oct 2015 07:30:00 GMT',
+        }))
+        self.assertEqual(0, get_freshness_lifetime({'Expires': '0'}))
+        self.assertIsNone(get_freshness_lifetime({}))
+
+
+class BackendTestCase(TestCase):
+
+    def test_lru_eviction(self):
+        backend = LRUCacheBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual(1, backend.get('a'))
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(3, backend.get('c'))
+
+    def test_lru_timeout(self):
+        backend = LRUCacheBackend()
+        backend.set('a', 1, timeout=10)
+        with patch('mbq.client.cache.time.time', return_value=time.time() + 11):
+            self.assertIsNone(backend.get('a'))
+
+    def test_django_cache_backend(self):
+        cache = MagicMock()
+        backend = DjangoCacheBackend(cache)
+        backend.set('some key', 1, timeout=10)
+        key = cache.set.call_args[0][0]
+        self.assertTrue(key.startswith('mbq.client.http:'))
+        self.assertNotIn(' ', key)
+
+        backend.get('some key')
+        cache.get.assert_called_once_with(key)
@@ -0,0 +1,158 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from mbq.client.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from mbq.client.client import ServiceClient
+from mbq.client.exceptions import CircuitOpenError, DeadlineExceeded
+
+from .test_client import make_response
+
+
+HOST = 'https://foo.com'
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        monotonic_patch = patch(
+            'mbq.client.circuit_breaker.time.monotonic', side_effect=lambda: self.now
+        )
+        monotonic_patch.start()
+        self.addCleanup(monotonic_patch.stop)
+
+        self.collector = MagicMock()
+        self.breaker = CircuitBreaker(
+            minimum_calls=4, window_size=4, open_duration=30, half_open_calls=2,
+            slow_call_duration=5, slow_call_rate_threshold=0.75, collector=self.collector,
+        )
+
+    def succeed(self, duration=0):
+        def send():
+            self.now += duration
+            return make_response()
+        return self.breaker.call(HOST, send)
+
+    def fail(self, status_code=503):
+        return self.breaker.call(HOST, lambda: make_response(status_code=status_code))
+
+    def error(self):
+        def send():
+            raise requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            self.breaker.call(HOST, send)
+
+    def test_opens_on_failure_rate(self):
+        self.succeed()
+        self.fail()
+        self.succeed()
+        self.assertEqual(CLOSED, self.breaker.get_state(HOST))
+        self.error()
+        self.assertEqual(OPEN, self.breaker.get_state(HOST))
+
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+        self.collector.increment.assert_any_call('circuit_breaker.rejected', tags={'host': HOST})
+        self.collector.gauge.assert_called_with('circuit_breaker.state', 2, tags={'host': HOST})
+
+    def test_client_errors_are_not_failures(self):
+        for _ in range(4):
+            self.fail(status_code=404)
+        self.assertEqual(CLOSED, self.breaker.get_state(HOST))
+
+    def test_opens_on_slow_calls(self):
+        for _ in range(3):
+            self.succeed(duration=6)
+        self.succeed()
+        self.assertEqual(OPEN, self.breaker.get_state(HOST))
+
+    def test_half_open_closes_after_successful_probes(self):
+        for _ in range(4):
+            self.fail()
+
+        self.now += 30
+        self.assertEqual(HALF_OPEN, self.breaker.get_state(HOST))
+        self.succeed()
+        self.assertEqual(HALF_OPEN, self.breaker.get_state(HOST))
+        self.succeed()
+        self.assertEqual(CLOSED, self.breaker.get_state(HOST))
+
+    def test_half_open_reopens_on_failure(self):
+        for _ in range(4):
+            self.fail()
+
+        self.now += 30
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.get_state(HOST))
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+
+    def test_half_open_limits_probes(self):
+        for _ in range(4):
+            self.fail()
+        self.now += 30
+
+        def send_while_probing():
+            # Two probes are in flight, so a third call is turned away.
+            with self.assertRaises(CircuitOpenError):
+                self.succeed()
+            return make_response()
+
+        self.breaker.call(HOST, lambda: self.breaker.call(HOST, send_while_probing))
+
+    def test_calls_from_before_a_state_change_are_not_probes(self):
+        circuit = self.breaker._get_circuit(HOST)
+
+        def send_while_circuit_opens():
+            for _ in range(4):
+                self.fail()
+            self.now += 30
+            self.assertIsNotNone(circuit.acquire())
+            return make_response()
+
+        self.breaker.call(HOST, send_while_circuit_opens)
+
+        # Only the probe counts towards closing the circuit.
+        self.assertEqual(HALF_OPEN, circuit.state)
+        self.assertEqual((1, 0), (circuit.probes, circuit.probe_successes))
+
+    def test_deadline_errors_are_not_probe_outcomes(self):
+        for _ in range(4):
+            self.fail()
+        self.now += 30
+
+        def send():
+            raise DeadlineExceeded()
+
+        with self.assertRaises(DeadlineExceeded):
+            self.breaker.call(HOST, send)
+
+        circuit = self.breaker._get_circuit(HOST)
+        self.assertEqual(HALF_OPEN, circuit.state)
+        self.assertEqual((0, 0), (circuit.probes, circuit.probe_successes))
+
+    def test_hosts_are_independent(self):
+        for _ in range(4):
+            self.fail()
+        self.breaker.call('https://bar.com', make_response)
+        self.assertEqual({HOST: OPEN, 'https://bar.com': CLOSED}, self.breaker.get_states())
+
+
+class ServiceClientCircuitBreakerTestCase(TestCase):
+
+    @patch('requests.Session.get')
+    def test_open_circuit_fails_fast(self, get):
+        get.side_effect = requests.ConnectTimeout()
+        breaker = CircuitBreaker(minimum_calls=2)
+        client = ServiceClient('https://foo.com', circuit_breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectTimeout):
+                client.get('/things')
+        with self.assertRaises(CircuitOpenError):
+            client.get('/things')
+
+        self.assertEqual(2, get.call_count)
+        self.assertEqual({'https://foo.com': OPEN}, breaker.get_states())
@@ -1,7 +1,31 @@
+import threading
+import time
+import typing
+from copy import copy
+from io import BufferedReader, BytesIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
-from mbq.client.client import ServiceClient
+import requests
+from requests.adapters import HTTPAdapter
+
+from mbq.client.circuit_breaker import CircuitBreaker
+from mbq.client.client import DeadlineAuth, ServiceClient
+from mbq.client.exceptions import DeadlineExceeded
+from mbq.client.lib import serialization
+from mbq.client.lib.deadlines import get_remaining
+from mbq.client.retry import RetryPolicy
+
+
+def make_response(status_code=200, content=b'{}', content_type='application/json'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    if content_type is not None:
+        response.headers['Content-Type'] = content_type
+    return response
 
 
 class CorrelationIDTestCase(TestCase):
@@ -11,7 +35,7 @@ class CorrelationIDTestCase(TestCase):
             'https://foo.com/',
             correlation_id_getter=lambda: 'hello-world'
         )
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client.get('/url')
             self.assertEqual(1, requests_mock.call_count)
             headers = requests_mock.call_args[1]['headers']
@@ -19,7 +43,7 @@ class CorrelationIDTestCase(TestCase):
 
     def test_correlation_id_getter_not_provided(self):
         self.client = ServiceClient('https://foo.com/')
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client.get('/url')
             self.assertEqual(1, requests_mock.call_count)
             headers = requests_mock.call_args[1]['headers']
@@ -33,7 +57,7 @@ class CorrelationIDTestCase(TestCase):
             correlation_id_getter=cid_getter_mock
         )
 
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client.get('/url')
             self.assertEqual(1, requests_mock.call_count)
             headers = requests_mock.call_args[1]['headers']
@@ -45,7 +69,7 @@ class CorrelationIDTestCase(TestCase):
             self.assertEqual('goodbye-world', headers.get('X-Correlation-Id'))
 
     def test_headers(self):
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client = ServiceClient(
                 'https://foo.com/',
                 headers={'Test-Header': 'header-value'}
@@ -54,7 +78,7 @@ class CorrelationIDTestCase(TestCase):
             headers = requests_mock.call_args[1]['headers']
             self.assertEqual('header-value', headers.get('Test-Header'))
 
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client = ServiceClient(
                 'https://foo.com/',
             )
@@ -62,7 +86,7 @@ class CorrelationIDTestCase(TestCase):
             headers = requests_mock.call_args[1]['headers']
             self.assertEqual('get-header-value', headers.get('Test-Get-Header'))
 
-        with patch('requests.Session.get') as requests_mock:
+        with patch('requests.Session.get', return_value=make_response()) as requests_mock:
             self.client = ServiceClient(
                 'https://foo.com/',
                 headers={'Test-Service-Header': 'service-header-value'}
@@ -71,3 +95,744 @@ class CorrelationIDTestCase(TestCase):
             headers = requests_mock.call_args[1]['headers']
             self.assertEqual('get-header-value-2', headers.get('Test-Get-Header-2'))
             self.assertEqual('service-header-value', headers.get('Test-Service-Header'))
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def test_default_adapters(self):
+        client = ServiceClient('https://foo.com/', pool_connections=4, pool_maxsize=25)
+        adapter = client.session.get_adapter('https://foo.com/url')
+        self.assertIs(adapter, client.session.get_adapter('http://bar.com/url'))
+        self.assertEqual(4, adapter._pool_connections)
+        self.assertEqual(25, adapter._pool_maxsize)
+        self.assertFalse(adapter._pool_block)
+
+    def test_per_host_adapters(self):
+        host_adapter = HTTPAdapter(pool_maxsize=50, pool_block=True)
+        client = ServiceClient(
+            'https://foo.com/',
+            adapters={'https://busy.foo.com': host_adapter},
+        )
+        self.assertIs(host_adapter, client.session.get_adapter('https://busy.foo.com/url'))
+        self.assertIsNot(host_adapter, client.session.get_adapter('https://foo.com/url'))
+
+    def test_pool_stats(self):
+        server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = ServiceClient('http://127.0.0.1:{}'.format(server.server_port))
+        self.assertEqual({}, client.pool_stats())
+
+        for _ in range(3):
+            client.get('/url')
+
+        stats = client.pool_stats()['http://127.0.0.1:{}'.format(server.server_port)]
+        self.assertEqual(10, stats['maxsize'])
+        self.assertEqual(0, stats['in_use'])
+        self.assertEqual(1, stats['connections'])
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(2, stats['reused'])
+
+
+class KeepAliveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    block_on_close = False
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ResponseDecodingTestCase(TestCase):
+
+    def get(self, response, **client_kwargs):
+        client = ServiceClient('https://foo.com', **client_kwargs)
+        with patch('requests.Session.get', return_value=response):
+            return client.get('/url')
+
+    def test_json(self):
+        self.assertEqual({'a': 1}, self.get(make_response(content=b'{"a": 1}')))
+        self.assertEqual([1], self.get(make_response(
+            content=b'[1]', content_type='application/json; charset=utf-8'
+        )))
+        self.assertEqual({'title': 'Bad'}, self.get(make_response(
+            content=b'{"title": "Bad"}', content_type='application/problem+json'
+        )))
+
+    def test_empty(self):
+        self.assertIsNone(self.get(make_response(content=b'')))
+        self.assertIsNone(self.get(make_response(content=b'', content_type=None)))
+        self.assertIsNone(self.get(make_response(status_code=204, content=b'')))
+
+    def test_binary_is_not_parsed(self):
+        with patch('mbq.client.client.serialization.loads') as loads_mock:
+            data = self.get(make_response(content=b'{"a": 1}', content_type='text/csv'))
+        loads_mock.assert_not_called()
+        self.assertIsInstance(data, BufferedReader)
+        self.assertEqual(b'{"a": 1}', data.read())
+
+    def test_missing_content_type(self):
+        self.assertEqual({'a': 1}, self.get(make_response(content=b'{"a": 1}', content_type=None)))
+        data = self.get(make_response(content=b'\x89PNG', content_type=None))
+        self.assertEqual(b'\x89PNG', data.read())
+
+    def test_invalid_json_raises(self):
+        with self.assertRaises(ValueError):
+            self.get(make_response(content=b'<html>'))
+
+    def test_post_process_response(self):
+        self.assertEqual(1, self.get(
+            make_response(content=b'{"a": 1}'),
+            post_process_response=lambda data: data['a'],
+        ))
+
+        with self.assertRaises(KeyError):
+            self.get(
+                make_response(content=b'{"a": 1}'),
+                post_process_response=lambda data: data['b'],
+            )
+
+    def test_registered_decoder(self):
+        decoder = Mock(return_value=['row'])
+        self.assertEqual(['row'], self.get(
+            make_response(content=b'row', content_type='Text/CSV; charset=utf-8'),
+            decoders={'text/csv': decoder},
+        ))
+
+        client = ServiceClient('https://foo.com')
+        client.register_decoder('application/json', lambda response: 'custom')
+        with patch('requests.Session.get', return_value=make_response()):
+            self.assertEqual('custom', client.get('/url'))
+
+
+class AuthReplayTestCase(TestCase):
+
+    def make_401(self):
+        response = make_response(status_code=401, content=b'')
+        response.raw = BytesIO()
+        response.request = requests.Request(
+            'GET', 'https://foo.com/url', headers={'Authorization': 'Bearer stale'}
+        ).prepare()
+        return response
+
+    def setUp(self):
+        self.auth = MagicMock()
+        self.collector = MagicMock()
+        self.client = ServiceClient('https://foo.com', auth=self.auth, collector=self.collector)
+
+    def test_replays_once_with_new_token(self):
+        responses = [self.make_401(), make_response(content=b'{"a": 1}')]
+        with patch('requests.Session.get', side_effect=responses) as get_mock:
+            self.assertEqual({'a': 1}, self.client.get('/url'))
+
+        self.assertEqual(2, get_mock.call_count)
+        self.auth.invalidate.assert_called_once_with('Bearer stale')
+        self.collector.increment.assert_called_once_with(
+            'request.auth_replay', tags={'method': 'get'}
+        )
+
+    def test_second_401_is_raised(self):
+        with patch('requests.Session.get', side_effect=[self.make_401(), self.make_401()]):
+            with self.assertRaises(requests.HTTPError):
+                self.client.get('/url')
+        self.assertEqual(1, self.auth.invalidate.call_count)
+
+    def test_streamed_bodies_are_not_replayed(self):
+        with patch('requests.Session.post', return_value=self.make_401()) as post_mock:
+            with self.assertRaises(requests.HTTPError):
+                self.client.post('/url', data=BytesIO(b'body'))
+        self.assertEqual(1, post_mock.call_count)
+        self.auth.invalidate.assert_not_called()
+
+    def test_auth_without_invalidate(self):
+        client = ServiceClient('https://foo.com', auth=('user', 'password'))
+        with patch('requests.Session.get', return_value=self.make_401()) as get_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.get('/url')
+        self.assertEqual(1, get_mock.call_count)
+
+    def test_new_token_is_fetched_within_the_deadline(self):
+        remaining = []
+        self.auth.invalidate.side_effect = lambda authorization: remaining.append(get_remaining())
+        responses = [self.make_401(), make_response()]
+        with patch('requests.Session.get', side_effect=responses):
+            self.client.get('/url', deadline=2)
+        self.assertTrue(1.9 < remaining[0] <= 2)
+
+        client = ServiceClient('https://foo.com', auth=('user', 'password'))
+        with patch('requests.Session.get', return_value=self.make_401()) as get_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.get('/url', deadline=2)
+        self.assertEqual(1, get_mock.call_count)
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status = 404 if self.path == '/missing' else 200
+        body = serialization.dumps({
+            'path': self.path,
+            'correlation_id': self.headers.get('X-Correlation-Id'),
+            'authorization': self.headers.get('Authorization'),
+            'api_key': self.headers.get('X-Api-Key'),
+        })
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class MapTestCase(TestCase):
+
+    def setUp(self):
+        server = KeepAliveServer(('127.0.0.1', 0), EchoHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        local = threading.local()
+        local.correlation_id = 'cid'
+
+        def set_authorization(request):
+            request.headers['Authorization'] = 'Bearer token'
+            return request
+
+        self.client = ServiceClient(
+            'http://127.0.0.1:{}'.format(server.server_port),
+            auth=set_authorization,
+            correlation_id_getter=lambda: getattr(local, 'correlation_id', None),
+            pool_maxsize=4,
+        )
+
+    def test_results_keep_order(self):
+        paths = ['/things/{}'.format(i) for i in range(50)]
+        results = self.client.map(paths)
+        self.assertEqual(paths, [result['path'] for result in results])
+
+    def test_request_forms(self):
+        results = self.client.map([
+            '/a',
+            ('post', '/b'),
+            ('get', '/c', {'params': {'page': 2}}),
+        ])
+        self.assertEqual(['/a', '/b', '/c?page=2'], [result['path'] for result in results])
+
+    def test_headers_and_auth_apply_to_each_request(self):
+        for result in self.client.map(['/a', '/b']):
+            # The getter reads a thread local, so it must run on the calling thread.
+            self.assertEqual('cid', result['correlation_id'])
+            self.assertEqual('Bearer token', result['authorization'])
+
+    def test_workers_use_the_session_settings(self):
+        self.client.session.headers['X-Api-Key'] = 'secret'
+        self.client.session.mount('http://', HTTPAdapter(pool_maxsize=2))
+        with patch.object(HTTPAdapter, 'send', autospec=True,
+                          side_effect=HTTPAdapter.send) as send_mock:
+            results = self.client.map(['/a', '/b'])
+
+        self.assertEqual(['secret', 'secret'], [result['api_key'] for result in results])
+        self.assertEqual(
+            {self.client.session.get_adapter('http://')},
+            {call[0][0] for call in send_mock.call_args_list},
+        )
+
+    def test_errors_are_returned_in_place(self):
+        first, missing, last = self.client.map(['/a', '/missing', '/b'])
+        self.assertEqual('/a', first['path'])
+        self.assertIsInstance(missing, requests.HTTPError)
+        self.assertEqual('/b', last['path'])
+
+    def test_empty(self):
+        self.assertEqual([], self.client.map([]))
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    """ Echoes the cookie a request sent and sets a new one from the query string. """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = serialization.dumps({'cookie': self.headers.get('Cookie')})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'name={}; Path=/'.format(self.path.split('=')[-1]))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadSafeTestCase(TestCase):
+
+    def setUp(self):
+        server = KeepAliveServer(('127.0.0.1', 0), CookieHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    def test_sessions_are_per_thread(self):
+        client = ServiceClient(self.base_url, thread_safe=True)
+        sessions = []
+
+        def get_session():
+            sessions.append(client.session)
+            sessions.append(client.session)
+
+        thread = threading.Thread(target=get_session)
+        thread.start()
+        thread.join()
+
+        self.assertIs(sessions[0], sessions[1])
+        self.assertIsNot(client.session, sessions[0])
+        self.assertIs(client.session.get_adapter(self.base_url),
+                      sessions[0].get_adapter(self.base_url))
+
+    def test_shared_session_by_default(self):
+        client = ServiceClient(self.base_url)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+        self.assertIs(client.session, sessions[0])
+
+    def test_session_can_be_replaced(self):
+        session = requests.Session()
+        client = ServiceClient(self.base_url)
+        client.session = session
+        self.assertIs(session, client.session)
+        self.assertEqual({'cookie': None}, client.get('/?name=a'))
+        self.assertEqual('a', session.cookies['name'])
+
+        client = ServiceClient(self.base_url, thread_safe=True)
+        client.session = session
+        self.assertIs(session, client.session)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+        self.assertIsNot(session, sessions[0])
+
+    def test_concurrent_requests(self):
+        client = ServiceClient(self.base_url, thread_safe=True, pool_maxsize=4, pool_block=True)
+        copied = copy(client)
+        errors = []
+
+        def work(name):
+            try:
+                for i in range(25):
+                    # Each thread only ever sees the cookie its own session was given.
+                    expected = 'name={}'.format(name) if i else None
+                    for c in (client, copied):
+                        result = c.get('/?name={}'.format(name))
+                        if result['cookie'] != expected:
+                            raise AssertionError('{} != {}'.format(result['cookie'], expected))
+                        expected = 'name={}'.format(name)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(str(i),)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        stats = client.pool_stats()[self.base_url]
+        self.assertEqual(16 * 25 * 2, stats['requests'])
+        self.assertLessEqual(stats['connections'], 4)
+        self.assertEqual(0, stats['in_use'])
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    release = threading.Event()
+    paths: typing.List[str] = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        self.release.wait(5)
+        status = 500 if self.path.startswith('/error') else 200
+        if self.path.startswith('/binary'):
+            content_type, body = 'application/octet-stream', b'binary body'
+        else:
+            content_type, body = 'application/json', serialization.dumps({'path': self.path})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CoalescingTestCase(TestCase):
+
+    def setUp(self):
+        SlowHandler.release.clear()
+        del SlowHandler.paths[:]
+        server = KeepAliveServer(('127.0.0.1', 0), SlowHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(SlowHandler.release.set)
+
+        self.client = ServiceClient(
+            'http://127.0.0.1:{}'.format(server.server_port), coalesce=True
+        )
+
+    def get_concurrently(self, calls, coalesced):
+        results = [None] * len(calls)
+
+        def get(i, url, kwargs):
+            try:
+                results[i] = self.client.get(url, **kwargs)
+            except Exception as e:
+                results[i] = e
+
+        threads = [
+            threading.Thread(target=get, args=(i, url, kwargs))
+            for i, (url, kwargs) in enumerate(calls)
+        ]
+        for thread in threads:
+            thread.start()
+
+        deadline = time.monotonic() + 5
+        while self.client.stats['coalesced'] < coalesced and time.monotonic() < deadline:
+            time.sleep(0.01)
+        SlowHandler.release.set()
+
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_gets_share_one_request(self):
+        results = self.get_concurrently([('/things', {'params': {'a': 1}})] * 10, 9)
+        self.assertEqual(['/things?a=1'], SlowHandler.paths)
+        self.assertEqual(9, self.client.stats['coalesced'])
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_different_gets_are_not_coalesced(self):
+        self.get_concurrently([
+            ('/things', {'params': {'a': 1}}),
+            ('/things', {'params': {'a': 2}}),
+            ('/things', {'params': {'a': 1}, 'headers': {'Accept': 'application/json'}}),
+        ], 0)
+        self.assertEqual(3, len(SlowHandler.paths))
+        self.assertEqual(0, self.client.stats['coalesced'])
+
+    def test_gets_with_different_credentials_are_not_coalesced(self):
+        self.get_concurrently([
+            ('/things', {'auth': ('alice', 'secret')}),
+            ('/things', {'auth': ('bob', 'secret')}),
+            ('/things', {'auth': lambda request: request}),
+            ('/things', {'auth': lambda request: request}),
+        ], 0)
+        self.assertEqual(4, len(SlowHandler.paths))
+        self.assertEqual(0, self.client.stats['coalesced'])
+
+    def test_errors_are_shared(self):
+        results = self.get_concurrently([('/error', {})] * 3, 2)
+        self.assertEqual(1, len(SlowHandler.paths))
+        self.assertTrue(all(isinstance(result, requests.HTTPError) for result in results))
+
+    def test_binary_bodies_can_be_read_by_every_caller(self):
+        results = self.get_concurrently([('/binary', {})] * 3, 2)
+        self.assertEqual(1, len(SlowHandler.paths))
+        self.assertEqual([b'binary body'] * 3, [result.read() for result in results])
+
+    def test_followers_keep_their_own_deadline(self):
+        leader = threading.Thread(target=self.client.get, args=('/things',))
+        leader.start()
+        while not SlowHandler.paths:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            self.client.get('/things', deadline=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(1, self.client.stats['coalesced'])
+
+        SlowHandler.release.set()
+        leader.join(5)
+
+    def test_leader_deadline_is_not_shared(self):
+        results = {}
+
+        def get(name, **kwargs):
+            try:
+                results[name] = self.client.get('/things', **kwargs)
+            except Exception as e:
+                results[name] = e
+
+        leader = threading.Thread(target=get, args=('leader',), kwargs={'deadline': 0.2})
+        leader.start()
+        while not SlowHandler.paths:
+            time.sleep(0.01)
+        follower = threading.Thread(target=get, args=('follower',))
+        follower.start()
+
+        leader.join(5)
+        SlowHandler.release.set()
+        follower.join(5)
+
+        self.assertIsInstance(results['leader'], DeadlineExceeded)
+        self.assertEqual({'path': '/things'}, results['follower'])
+        self.assertEqual(1, self.client.stats['coalesced'])
+        self.assertEqual(2, len(SlowHandler.paths))
+
+    def test_later_gets_are_sent(self):
+        SlowHandler.release.set()
+        self.client.get('/things')
+        self.client.get('/things')
+        self.assertEqual(2, len(SlowHandler.paths))
+        self.assertEqual(0, self.client.stats['coalesced'])
+
+
+class TimeoutTestCase(TestCase):
+
+    @patch('requests.Session.get')
+    def test_connect_and_read_timeouts(self, get):
+        get.return_value = make_response()
+
+        ServiceClient('https://foo.com', connect_timeout=3.05, read_timeout=60).get('/url')
+        self.assertEqual((3.05, 60), get.call_args[1]['timeout'])
+
+        ServiceClient('https://foo.com', connect_timeout=1, default_timeout=10).get('/url')
+        self.assertEqual((1, 10), get.call_args[1]['timeout'])
+
+        ServiceClient('https://foo.com').get('/url')
+        self.assertEqual(30, get.call_args[1]['timeout'])
+
+    @patch('requests.Session.get')
+    def test_deadline_caps_timeouts(self, get):
+        get.return_value = make_response()
+        client = ServiceClient('https://foo.com', connect_timeout=1, read_timeout=30)
+
+        client.get('/url', deadline=5)
+        connect_timeout, read_timeout = get.call_args[1]['timeout']
+        self.assertEqual(1, connect_timeout)
+        self.assertLessEqual(read_timeout, 5)
+        self.assertGreater(read_timeout, 4)
+
+    @patch('requests.Session.get')
+    def test_deadline_getter(self, get):
+        get.return_value = make_response()
+        client = ServiceClient('https://foo.com', deadline_getter=lambda: 2)
+
+        client.get('/url')
+        self.assertLessEqual(get.call_args[1]['timeout'], 2)
+
+        client.get('/url', deadline=1)
+        self.assertLessEqual(get.call_args[1]['timeout'], 1)
+
+    @patch('requests.Session.get')
+    def test_expired_deadline(self, get):
+        with self.assertRaises(DeadlineExceeded):
+            ServiceClient('https://foo.com').get('/url', deadline=0)
+        get.assert_not_called()
+
+    @patch('requests.Session.get')
+    def test_deadline_stops_retries(self, get):
+        get.side_effect = requests.ConnectionError()
+        client = ServiceClient('https://foo.com', retry_policy=RetryPolicy(
+            max_attempts=10, backoff_factor=0.2, max_backoff=0.2,
+        ))
+
+        with patch('mbq.client.retry.random.uniform', return_value=0.2):
+            with self.assertRaises(requests.ConnectionError):
+                client.get('/url', deadline=0.5)
+        self.assertEqual(3, get.call_count)
+
+    def test_deadline_header_and_auth(self):
+        request = MagicMock(headers={})
+        auth = Mock(side_effect=lambda request: request, service_name='my_service')
+        deadline_auth = DeadlineAuth(auth, time.monotonic() + 2, 'X-Deadline-Remaining-Ms')
+
+        deadline_auth(request)
+        auth.assert_called_once_with(request)
+        self.assertTrue(1900 < int(request.headers['X-Deadline-Remaining-Ms']) <= 2000)
+        self.assertEqual('my_service', deadline_auth.service_name)
+
+        # The token fetch runs within the deadline.
+        remaining = []
+        DeadlineAuth(lambda request: remaining.append(get_remaining()) or request,
+                     time.monotonic() + 2, 'X-Deadline-Remaining-Ms')(request)
+        self.assertTrue(1.9 < remaining[0] <= 2)
+        self.assertIsNone(get_remaining())
+
+        slow_auth = DeadlineAuth(lambda request: time.sleep(0.02) or request,
+                                 time.monotonic() + 0.01, 'X-Deadline-Remaining-Ms')
+        with self.assertRaises(DeadlineExceeded):
+            slow_auth(request)
+
+    def test_deadline_cuts_slow_response_short(self):
+        SlowHandler.release.clear()
+        server = KeepAliveServer(('127.0.0.1', 0), SlowHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(SlowHandler.release.set)
+
+        client = ServiceClient(
+            'http://127.0.0.1:{}'.format(server.server_port),
+            retry_policy=RetryPolicy(),
+            circuit_breaker=CircuitBreaker(minimum_calls=1),
+        )
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            client.get('/slow', deadline=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+        # Not the host's fault, so the circuit stays closed.
+        self.assertEqual('closed', client._circuit_breaker.get_state(client._api_url))
+
+
+class PagingHandler(BaseHTTPRequestHandler):
+    """ Serves 25 items, 10 a page, with tastypie-style offsets under /offset, absolute
+    next links under /link and cursors under /cursor.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    paths: typing.List[str] = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        path, _, query = self.path.partition('?')
+        query = dict(part.split('=') for part in query.split('&') if part)
+        start = int(query.get('offset') or query.get('cursor') or 0)
+        objects = list(range(25))[start:start + 10]
+        more = start + 10 < 25
+
+        if path == '/offset':
+            page = {
+                'meta': {'next': '/offset?offset={}'.format(start + 10) if more else None},
+                'objects': objects,
+            }
+        elif path == '/link':
+            page = {
+                'next': 'http://{}:{}/link?offset={}'.format(
+                    *self.server.server_address, start + 10
+                ) if more else None,
+                'objects': objects,
+            }
+        elif path == '/cursor':
+            page = {'next_cursor': str(start + 10) if more else None, 'items': objects}
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = serialization.dumps(page)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PaginateTestCase(TestCase):
+
+    def setUp(self):
+        del PagingHandler.paths[:]
+        server = KeepAliveServer(('127.0.0.1', 0), PagingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = ServiceClient('http://127.0.0.1:{}'.format(server.server_port))
+
+    def test_meta_next(self):
+        self.assertEqual(list(range(25)), list(self.client.paginate('/offset')))
+        self.assertEqual(
+            ['/offset', '/offset?offset=10', '/offset?offset=20'], PagingHandler.paths
+        )
+
+    def test_next_link(self):
+        self.assertEqual(list(range(25)), list(self.client.paginate('/link')))
+        self.assertEqual(3, len(PagingHandler.paths))
+
+    def test_cursor(self):
+        items = self.client.paginate(
+            '/cursor', params={'a': 'b'}, items_key='items', cursor_param='cursor'
+        )
+        self.assertEqual(list(range(25)), list(items))
+        self.assertEqual(
+            ['/cursor?a=b', '/cursor?a=b&cursor=10', '/cursor?a=b&cursor=20'],
+            PagingHandler.paths,
+        )
+
+    def test_is_lazy(self):
+        items = self.client.paginate('/offset')
+        self.assertEqual([], PagingHandler.paths)
+        self.assertEqual(0, next(items))
+        self.assertEqual(1, len(PagingHandler.paths))
+        items.close()
+
+    def test_prefetch(self):
+        items = self.client.paginate('/offset', prefetch=True)
+        self.assertEqual(0, next(items))
+
+        # The second page is requested while the first is still being consumed.
+        deadline = time.monotonic() + 5
+        while len(PagingHandler.paths) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['/offset', '/offset?offset=10'], PagingHandler.paths)
+
+        self.assertEqual(list(range(1, 25)), list(items))
+        self.assertEqual(3, len(PagingHandler.paths))
+
+    def test_prefetch_uses_its_own_session(self):
+        self.client.session.headers['X-Api-Key'] = 'secret'
+        sessions = []
+        get = requests.Session.get
+
+        def record_session(session, *args, **kwargs):
+            sessions.append(session)
+            return get(session, *args, **kwargs)
+
+        with patch('requests.Session.get', autospec=True, side_effect=record_session):
+            items = self.client.paginate('/offset', prefetch=True)
+            self.assertEqual(list(range(25)), list(items))
+
+        self.assertEqual(3, len(sessions))
+        self.assertIs(self.client.session, sessions[0])
+        self.assertFalse(any(session is self.client.session for session in sessions[1:]))
+        self.assertEqual(['secret'] * 3, [session.headers['X-Api-Key'] for session in sessions])
+
+    def test_errors(self):
+        with self.assertRaises(requests.HTTPError):
+            list(self.client.paginate('/missing'))
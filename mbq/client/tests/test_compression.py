@@ -0,0 +1,130 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from mbq.client.client import ServiceClient
+from mbq.client.lib import serialization
+from mbq.client.lib.compression import compress
+
+from .test_client import KeepAliveServer
+
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+
+PAYLOAD = {'objects': [{'id': i, 'name': 'thing {}'.format(i)} for i in range(2000)]}
+
+
+class DecompressingHandler(BaseHTTPRequestHandler):
+    """ Echoes the decoded JSON body it was sent along with its encoding. Paths under
+    /strict reject compressed bodies.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+
+        if encoding and self.path.startswith('/strict'):
+            status, response = 415, {}
+        else:
+            if encoding == 'gzip':
+                body = gzip.decompress(body)
+            elif encoding == 'br':
+                body = brotli.decompress(body)
+            status, response = 200, {
+                'encoding': encoding,
+                'size': int(self.headers['Content-Length']),
+                'content_type': self.headers.get('Content-Type'),
+                'body': serialization.loads(body),
+            }
+
+        response_body = serialization.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_PUT = do_PATCH = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class RequestCompressionTestCase(TestCase):
+
+    def setUp(self):
+        server = KeepAliveServer(('127.0.0.1', 0), DecompressingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    def test_large_bodies_are_compressed(self):
+        client = ServiceClient(self.base_url, compression='gzip')
+        for method in (client.post, client.put, client.patch):
+            result = method('/things', json=PAYLOAD)
+            self.assertEqual('gzip', result['encoding'])
+            self.assertEqual('application/json', result['content_type'])
+            self.assertEqual(PAYLOAD, result['body'])
+            self.assertLess(result['size'], len(serialization.dumps(PAYLOAD)) / 4)
+
+    def test_small_bodies_are_not_compressed(self):
+        client = ServiceClient(self.base_url, compression='gzip')
+        result = client.post('/things', json={'id': 1})
+        self.assertIsNone(result['encoding'])
+        self.assertEqual({'id': 1}, result['body'])
+
+    def test_disabled_by_default(self):
+        result = ServiceClient(self.base_url).post('/things', json=PAYLOAD)
+        self.assertIsNone(result['encoding'])
+
+    def test_explicit_headers_are_kept(self):
+        client = ServiceClient(self.base_url, compression='gzip')
+        headers = {'Content-Type': 'application/vnd.api+json'}
+        result = client.post('/things', json=PAYLOAD, headers=headers)
+        self.assertEqual('application/vnd.api+json', result['content_type'])
+        self.assertEqual({'Content-Type': 'application/vnd.api+json'}, headers)
+
+    def test_unsupported_media_type_falls_back(self):
+        collector = MagicMock()
+        client = ServiceClient(self.base_url, compression='gzip', collector=collector)
+
+        result = client.post('/strict/things', json=PAYLOAD)
+        self.assertIsNone(result['encoding'])
+        self.assertEqual(PAYLOAD, result['body'])
+        collector.increment.assert_called_once_with(
+            'request.compression.rejected', tags={'host': self.base_url.split('://')[1]}
+        )
+
+        # The host is remembered, so the next body goes uncompressed straight away.
+        result = client.post('/strict/things', json=PAYLOAD)
+        self.assertIsNone(result['encoding'])
+        self.assertEqual(1, collector.increment.call_count)
+
+    def test_brotli(self):
+        if not HAS_BROTLI:
+            self.skipTest('brotli is not installed')
+
+        client = ServiceClient(self.base_url, compression='br')
+        result = client.post('/things', json=PAYLOAD)
+        self.assertEqual('br', result['encoding'])
+        self.assertEqual(PAYLOAD, result['body'])
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            ServiceClient(self.base_url, compression='zstd')
+
+    def test_compress(self):
+        data = serialization.dumps(PAYLOAD)
+        self.assertEqual(data, gzip.decompress(compress(data, 'gzip')))
+        self.assertEqual(data, gzip.decompress(compress(data, 'gzip', level=1)))
@@ -0,0 +1,139 @@
+import threading
+from unittest import TestCase
+from unittest.mock import ANY, MagicMock, call, patch
+
+import requests
+
+from mbq.client.client import ServiceClient
+from mbq.client.instrumentation import RequestHook, RouteTemplates
+
+from .test_client import EchoHandler, KeepAliveServer, make_response
+
+
+class RouteTemplatesTestCase(TestCase):
+
+    def test_templates(self):
+        routes = RouteTemplates(['/api/v1/people/{person_id}/roles', '/api/v1/people/{id}'])
+        self.assertEqual(
+            '/api/v1/people/{person_id}/roles',
+            routes.get_route('https://foo.com/api/v1/people/abc/roles/?page=2'),
+        )
+        self.assertEqual('/api/v1/people/{id}', routes.get_route('/api/v1/people/abc'))
+
+    def test_ids_are_replaced(self):
+        routes = RouteTemplates()
+        self.assertEqual(
+            '/api/v1/orgs/{id}/people/{id}/',
+            routes.get_route('https://foo.com/api/v1/orgs/42/people/'
+                             '7c9e6679-7425-40de-944b-e07fc1f90ae7/'),
+        )
+        self.assertEqual(
+            '/api/v1/things/{id}', routes.get_route('/api/v1/things/5f2b9d0c1a2b3c4d5e6f7a8b')
+        )
+        self.assertEqual('/api/v1/things/latest', routes.get_route('/api/v1/things/latest'))
+        self.assertEqual('/', routes.get_route('https://foo.com'))
+
+
+class RequestMetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.collector = MagicMock()
+        self.client = ServiceClient('https://foo.com', collector=self.collector)
+
+    @patch('requests.Session.get')
+    def test_latency_and_size(self, get):
+        get.return_value = make_response(content=b'{"a": 1}')
+        self.client.get('/api/v1/things/42')
+
+        tags = {'host': 'foo.com', 'method': 'get', 'route': '/api/v1/things/{id}', 'status': '2xx'}
+        self.collector.timing.assert_called_once_with('request.time', ANY, tags=tags)
+        self.collector.histogram.assert_any_call('request.bytes_received', 8, tags=tags)
+
+    @patch('requests.Session.get')
+    def test_errors(self, get):
+        get.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            self.client.get('/url')
+
+        tags = {'host': 'foo.com', 'method': 'get', 'route': '/url', 'status': 'error'}
+        self.collector.timing.assert_called_once_with('request.time', ANY, tags=tags)
+
+    @patch('requests.Session.get')
+    def test_not_instrumented_without_collector(self, get):
+        get.return_value = make_response()
+        ServiceClient('https://foo.com').get('/url')
+        self.assertNotIn('hooks', get.call_args[1])
+        self.assertNotIn('auth', get.call_args[1])
+
+
+class RecordingHook(RequestHook):
+
+    def __init__(self):
+        self.finished = []
+
+    def on_request(self, method, url, headers, route):
+        headers['Traceparent'] = 'trace'
+        return (method, route)
+
+    def on_response(self, context, response=None, error=None):
+        self.finished.append((context, response.status_code if response else None, error))
+
+
+class LiveInstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        server = KeepAliveServer(('127.0.0.1', 0), EchoHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    def test_hooks_and_auth_time(self):
+        sent_headers = []
+
+        def auth(request):
+            sent_headers.append(dict(request.headers))
+            request.headers['Authorization'] = 'Bearer token'
+            return request
+
+        collector = MagicMock()
+        hook = RecordingHook()
+        client = ServiceClient(self.base_url, auth=auth, collector=collector, hooks=[hook])
+        client.post('/things/1', json={'a': 1})
+
+        self.assertEqual('trace', sent_headers[0]['Traceparent'])
+        self.assertEqual([(('post', '/things/{id}'), 200, None)], hook.finished)
+
+        tags = {
+            'host': self.base_url.split('://')[1],
+            'method': 'post',
+            'route': '/things/{id}',
+            'status': '2xx',
+        }
+        collector.timing.assert_has_calls([
+            call('request.auth.time', ANY, tags=tags),
+            call('request.time', ANY, tags=tags),
+        ])
+        collector.histogram.assert_any_call('request.bytes_sent', len(b'{"a": 1}'), tags=tags)
+
+    def test_failing_hooks_are_logged(self):
+        hook = MagicMock()
+        hook.on_response.side_effect = ValueError()
+        client = ServiceClient(self.base_url, hooks=[hook])
+
+        with self.assertLogs('mbq.client.client', level='ERROR'):
+            self.assertEqual('/url', client.get('/url')['path'])
+
+        hook.reset_mock()
+        hook.on_request.side_effect = ValueError()
+        hook.on_response.side_effect = None
+        with self.assertLogs('mbq.client.client', level='ERROR'):
+            self.assertEqual('/url', client.get('/url')['path'])
+        hook.on_response.assert_called_once_with(None, response=ANY, error=None)
+
+    def test_report_pool_stats(self):
+        collector = MagicMock()
+        client = ServiceClient(self.base_url, collector=collector)
+        client.get('/url')
+        client.report_pool_stats()
+        collector.gauge.assert_any_call('pool.connections', 1, tags={'host': self.base_url})
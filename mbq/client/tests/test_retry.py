@@ -0,0 +1,137 @@
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock, call, patch
+
+import requests
+
+from mbq.client.client import ServiceClient
+from mbq.client.retry import RetryPolicy
+
+
+def make_response(status_code, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+class RetryPolicyTestCase(TestCase):
+
+    def setUp(self):
+        sleep_patch = patch('mbq.client.retry.time.sleep')
+        self.sleep = sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    def test_is_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable('get', response=make_response(503)))
+        self.assertTrue(policy.is_retryable('GET', error=requests.ConnectionError()))
+        self.assertTrue(policy.is_retryable('delete', error=requests.ReadTimeout()))
+        self.assertFalse(policy.is_retryable('get', response=make_response(500)))
+        self.assertFalse(policy.is_retryable('get', response=make_response(200)))
+        self.assertFalse(policy.is_retryable('get', error=ValueError()))
+        self.assertFalse(policy.is_retryable('post', response=make_response(503)))
+        self.assertFalse(policy.is_retryable('patch', error=requests.ConnectionError()))
+
+    def test_backoff_full_jitter(self):
+        policy = RetryPolicy(backoff_factor=1, max_backoff=5)
+        with patch('mbq.client.retry.random.uniform', return_value=0.5) as uniform:
+            self.assertEqual(0.5, policy.get_backoff(1))
+            uniform.assert_called_once_with(0, 2)
+            policy.get_backoff(10)
+            uniform.assert_called_with(0, 5)
+
+    def test_backoff_retry_after(self):
+        policy = RetryPolicy(max_backoff=60)
+        self.assertEqual(7, policy.get_backoff(1, make_response(503, {'Retry-After': '7'})))
+        self.assertEqual(0, policy.get_backoff(
+            1, make_response(503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        ))
+        self.assertIsNone(policy.get_backoff(1, make_response(503, {'Retry-After': '120'})))
+
+        policy = RetryPolicy(respect_retry_after=False, backoff_factor=0)
+        self.assertEqual(0, policy.get_backoff(1, make_response(503, {'Retry-After': '7'})))
+
+    def test_call_retries_until_success(self):
+        send = Mock(side_effect=[
+            requests.ConnectionError(), make_response(503), make_response(200),
+        ])
+        on_attempt = Mock()
+        response = RetryPolicy(max_attempts=5).call('get', send, on_attempt=on_attempt)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, send.call_count)
+        self.assertEqual(2, self.sleep.call_count)
+        self.assertEqual([1, 2, 3], [c[0][0] for c in on_attempt.call_args_list])
+
+    def test_call_gives_up(self):
+        send = Mock(side_effect=requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            RetryPolicy(max_attempts=3).call('get', send)
+        self.assertEqual(3, send.call_count)
+
+        send = Mock(return_value=make_response(503))
+        self.assertEqual(503, RetryPolicy(max_attempts=2).call('get', send).status_code)
+        self.assertEqual(2, send.call_count)
+
+    def test_call_respects_budget(self):
+        send = Mock(return_value=make_response(503, {'Retry-After': '5'}))
+        RetryPolicy(max_attempts=5).call('get', send, budget=2)
+        self.assertEqual(1, send.call_count)
+        self.sleep.assert_not_called()
+
+    def test_long_retry_after_is_not_retried(self):
+        send = Mock(return_value=make_response(503, {'Retry-After': '120'}))
+        self.assertEqual(503, RetryPolicy(max_attempts=3).call('get', send).status_code)
+        self.assertEqual(1, send.call_count)
+        self.sleep.assert_not_called()
+
+
+class ServiceClientRetryTestCase(TestCase):
+
+    def setUp(self):
+        sleep_patch = patch('mbq.client.retry.time.sleep')
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    def test_no_retries_by_default(self):
+        client = ServiceClient('https://foo.com')
+        with patch('requests.Session.get', return_value=make_response(503)) as get_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.get('/url')
+        self.assertEqual(1, get_mock.call_count)
+
+    def test_streamed_bodies_are_not_retried(self):
+        client = ServiceClient('https://foo.com', retry_policy=RetryPolicy(max_attempts=3))
+        responses = [make_response(503), make_response(200)]
+        with patch('requests.Session.put', side_effect=responses) as put_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.put('/url', data=BytesIO(b'hello world'))
+        self.assertEqual(1, put_mock.call_count)
+
+    def test_client_policy(self):
+        collector = MagicMock()
+        client = ServiceClient(
+            'https://foo.com', retry_policy=RetryPolicy(max_attempts=3), collector=collector
+        )
+        with patch('requests.Session.get', return_value=make_response(503)) as get_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.get('/url')
+        self.assertEqual(3, get_mock.call_count)
+        attempts = [c for c in collector.histogram.call_args_list if c[0][0] == 'request.attempts']
+        self.assertEqual([call('request.attempts', 3, tags={'method': 'get'})], attempts)
+        collector.increment.assert_called_once_with(
+            'request.retries', value=2, tags={'method': 'get'}
+        )
+
+        with patch('requests.Session.post', return_value=make_response(503)) as post_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.post('/url')
+        self.assertEqual(1, post_mock.call_count)
+
+    def test_per_call_policy(self):
+        client = ServiceClient('https://foo.com', retry_policy=RetryPolicy(max_attempts=3))
+        with patch('requests.Session.get', return_value=make_response(503)) as get_mock:
+            with self.assertRaises(requests.HTTPError):
+                client.get('/url', retry_policy=RetryPolicy(max_attempts=2))
+        self.assertEqual(2, get_mock.call_count)
+        self.assertNotIn('retry_policy', get_mock.call_args[1])
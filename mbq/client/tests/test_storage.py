@@ -1,18 +1,25 @@
 import os
+import threading
+import time
 from tempfile import NamedTemporaryFile
 from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
-from mbq.client.storage import FileStorage
+from mbq.client.storage import DjangoCacheStorage, FileStorage, SQLiteStorage
 
 
-class FileStorageTestCase(TestCase):
+class StorageTestMixin:
+
+    storage_class: type = FileStorage
 
     def setUp(self):
         self.test_filename = NamedTemporaryFile(delete=False).name
-        self.storage = FileStorage(self.test_filename)
+        self.storage = self.storage_class(self.test_filename)
 
     def tearDown(self):
-        os.remove(self.test_filename)
+        for suffix in ['', '.lock', '-wal', '-shm']:
+            if os.path.exists(self.test_filename + suffix):
+                os.remove(self.test_filename + suffix)
 
     def test_storage(self):
         # When the file is empty, we should receive None for any key.
@@ -44,8 +51,128 @@ class FileStorageTestCase(TestCase):
         self.assertIsNone(self.storage.get('key3'))
 
         # If we re-init the storage object with the same file,
-        self.storage = FileStorage(self.test_filename)
+        self.storage = self.storage_class(self.test_filename)
         # all keys should be persisted.
         self.assertEqual(self.storage.get('key2'), 'some-new-value')
         self.assertEqual(self.storage.get('key1'), 'value1')
         self.assertIsNone(self.storage.get('key3'))
+
+    def test_bulk_operations(self):
+        self.assertEqual({}, self.storage.get_many(['key1', 'key2']))
+
+        self.storage.set_many({'key1': 'value1', 'key2': 'value2'})
+        self.assertEqual(
+            {'key1': 'value1', 'key2': 'value2'},
+            self.storage.get_many(['key1', 'key2', 'key3']),
+        )
+
+        self.storage.delete('key1')
+        self.storage.delete('key3')
+        self.assertIsNone(self.storage.get('key1'))
+        self.assertEqual({'key2': 'value2'}, self.storage.get_many(['key1', 'key2']))
+
+    def test_timeout(self):
+        self.storage.set('key1', 'value1', timeout=10)
+        self.storage.set_many({'key2': 'value2', 'key3': 'value3'}, timeout=20)
+        self.storage.set('key4', 'value4')
+
+        with patch('mbq.client.storage.time.time', return_value=time.time() + 15):
+            self.assertIsNone(self.storage.get('key1'))
+            self.assertEqual(
+                {'key2': 'value2', 'key3': 'value3', 'key4': 'value4'},
+                self.storage.get_many(['key1', 'key2', 'key3', 'key4']),
+            )
+
+        # Setting a key without a timeout clears its expiry.
+        self.storage.set('key2', 'value2')
+        with patch('mbq.client.storage.time.time', return_value=time.time() + 25):
+            self.assertEqual('value2', self.storage.get('key2'))
+            self.assertIsNone(self.storage.get('key3'))
+
+    def test_shared_between_instances(self):
+        other_storage = self.storage_class(self.test_filename)
+
+        self.storage.set('key1', 'value1')
+        self.assertEqual('value1', other_storage.get('key1'))
+
+        other_storage.set('key1', 'value2')
+        other_storage.set('key2', 'value3')
+        self.assertEqual('value2', self.storage.get('key1'))
+        self.assertEqual('value3', self.storage.get('key2'))
+
+    def test_concurrent_writers(self):
+        def write(writer):
+            storage = self.storage_class(self.test_filename)
+            for i in range(20):
+                storage.set('key-{}-{}'.format(writer, i), i)
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        storage = self.storage_class(self.test_filename)
+        for writer in range(4):
+            for i in range(20):
+                self.assertEqual(i, storage.get('key-{}-{}'.format(writer, i)))
+
+
+class FileStorageTestCase(StorageTestMixin, TestCase):
+
+    def test_reads_are_cached(self):
+        self.storage.set('key1', 'value1')
+
+        with patch('mbq.client.storage.json.load') as load_mock:
+            self.assertEqual('value1', self.storage.get('key1'))
+            self.assertEqual('value1', self.storage.get('key1'))
+        load_mock.assert_not_called()
+
+    def test_writes_are_atomic(self):
+        self.storage.set('key1', 'value1')
+
+        with patch('mbq.client.storage.json.dump', side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                self.storage.set('key2', object())
+
+        self.assertEqual('value1', FileStorage(self.test_filename).get('key1'))
+        directory = os.path.dirname(self.test_filename)
+        basename = os.path.basename(self.test_filename)
+        self.assertEqual([], [
+            name for name in os.listdir(directory) if name.startswith('.{}.'.format(basename))
+        ])
+
+
+class DjangoCacheStorageTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = MagicMock()
+        self.storage = DjangoCacheStorage(self.cache, timeout=3600)
+
+    def test_default_timeout(self):
+        self.storage.set('key1', 'value1')
+        self.cache.set.assert_called_once_with('key1', 'value1', timeout=3600)
+
+        self.storage.set_many({'key1': 'value1'})
+        self.cache.set_many.assert_called_once_with({'key1': 'value1'}, timeout=3600)
+
+    def test_timeout(self):
+        self.storage.set('key1', 'value1', timeout=60)
+        self.cache.set.assert_called_once_with('key1', 'value1', timeout=60)
+
+        self.storage.set_many({'key1': 'value1'}, timeout=60)
+        self.cache.set_many.assert_called_once_with({'key1': 'value1'}, timeout=60)
+
+    def test_get_many(self):
+        self.cache.get_many.return_value = {'key1': 'value1'}
+        self.assertEqual({'key1': 'value1'}, self.storage.get_many(['key1', 'key2']))
+        self.cache.get_many.assert_called_once_with(['key1', 'key2'])
+
+    def test_delete(self):
+        self.storage.delete('key1')
+        self.cache.delete.assert_called_once_with('key1')
+
+
+class SQLiteStorageTestCase(StorageTestMixin, TestCase):
+
+    storage_class = SQLiteStorage
@@ -0,0 +1,89 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import TestCase
+
+import requests
+
+from mbq.client.client import ServiceClient
+from mbq.client.streaming import ResponseStream
+
+
+BODY = b'0123456789' * 10000
+
+
+class StreamingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/missing':
+            body, status, headers = b'not found', 404, {}
+        elif self.path == '/gzip':
+            body, status, headers = gzip.compress(BODY), 200, {'Content-Encoding': 'gzip'}
+        else:
+            body, status, headers = BODY, 200, {}
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    block_on_close = False
+
+
+class StreamingTestCase(TestCase):
+
+    def setUp(self):
+        server = StreamingServer(('127.0.0.1', 0), StreamingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+        self.client = ServiceClient(self.base_url, stream_chunk_size=4096)
+
+    def test_read(self):
+        with self.client.get('/file', stream=True) as stream:
+            self.assertIsInstance(stream, ResponseStream)
+            self.assertEqual(200, stream.status_code)
+            self.assertEqual(BODY[:5], stream.read(5))
+            self.assertEqual(BODY[5:], stream.read())
+        self.assertEqual(0, self.client.pool_stats()[self.base_url]['in_use'])
+
+    def test_iter_chunks(self):
+        stream = self.client.get('/file', stream=True)
+        chunks = list(stream.iter_chunks())
+        self.assertEqual(BODY, b''.join(chunks))
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertTrue(stream.closed)
+
+        stream = self.client.get('/file', stream=True, chunk_size=1000)
+        self.assertEqual(100, len(list(stream.iter_chunks())))
+
+    def test_decompression(self):
+        with self.client.get('/gzip', stream=True) as stream:
+            self.assertEqual(BODY, stream.read())
+
+        with self.client.get('/gzip', stream=True, decode_content=False) as stream:
+            self.assertEqual(BODY, gzip.decompress(stream.read()))
+
+    def test_close_early_releases_connection(self):
+        stream = self.client.get('/file', stream=True)
+        stream.read(10)
+        self.assertEqual(1, self.client.pool_stats()[self.base_url]['in_use'])
+        stream.close()
+        self.assertEqual(0, self.client.pool_stats()[self.base_url]['in_use'])
+
+    def test_bad_response(self):
+        with self.assertRaises(requests.HTTPError):
+            self.client.get('/missing', stream=True)
@@ -1,7 +1,17 @@
+import base64
+import json
+import threading
+import time
 from unittest import TestCase
-from unittest.mock import MagicMock, call, patch
+from unittest.mock import ANY, MagicMock, call, patch
 
-from mbq.client.token_manager import TokenManager
+from mbq.client.exceptions import DeadlineExceeded
+from mbq.client.lib.deadlines import deadline_scope
+from mbq.client.token_manager import TokenManager, get_token_expiry
+
+
+def token_response(get_token):
+    return lambda *args: {'access_token': get_token(*args), 'expires_in': 86400}
 
 
 class TokenManagerTestCase(TestCase):
@@ -20,8 +30,8 @@ class TokenManagerTestCase(TestCase):
         self.get_auth0_token = MagicMock()
 
         get_auth0_token_patch = patch(
-            'mbq.client.token_manager.get_access_token',
-            self.get_auth0_token
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(self.get_auth0_token)
         )
         get_auth0_token_patch.start()
         self.addCleanup(get_auth0_token_patch.stop)
@@ -54,16 +64,588 @@ class TokenManagerTestCase(TestCase):
 
         self.set.assert_called_once_with(
             'token:test',
-            expected_token
+            expected_token,
+            timeout=ANY,
         )
+        # Stored until expires_in less the expiry margin.
+        self.assertAlmostEqual(86400 - 30, self.set.call_args[1]['timeout'], delta=2)
 
     def test_refresh_all_tokens(self):
 
-        refresh_token_mock = MagicMock()
-        self.token_manager.refresh_token = refresh_token_mock
+        self.get_auth0_token.side_effect = lambda audience, *args: 'token-{}'.format(audience)
 
         self.token_manager.refresh_all_tokens()
 
-        refresh_token_mock.assert_has_calls(
-            [call('test'), call('other_service')], any_order=True
+        self.get_auth0_token.assert_has_calls([
+            call('test_id', 'client_id', 'shh... it\'s a secret', 'auth0.com'),
+            call('other_id', 'client_id', 'shh... it\'s a secret', 'auth0.com'),
+        ], any_order=True)
+
+        self.storage_mock.set_many.assert_called_once_with({
+            'token:test': 'token-test_id',
+            'token:other_service': 'token-other_id',
+        }, timeout=ANY)
+        self.set.assert_not_called()
+
+    def test_prefetch_tokens(self):
+        self.storage_mock.get_many.return_value = {'token:test': 'stored-token'}
+        self.get_auth0_token.return_value = 'fetched-token'
+
+        tokens = self.token_manager.prefetch_tokens()
+
+        self.assertEqual({'test': 'stored-token', 'other_service': 'fetched-token'}, tokens)
+        self.storage_mock.get_many.assert_called_once_with(['token:test', 'token:other_service'])
+        self.get_auth0_token.assert_called_once_with(
+            'other_id', 'client_id', 'shh... it\'s a secret', 'auth0.com'
+        )
+        self.storage_mock.set_many.assert_called_once_with(
+            {'token:other_service': 'fetched-token'}, timeout=ANY
+        )
+
+    def test_prefetch_tokens_refreshes_expiring_tokens(self):
+        self.storage_mock.get_many.return_value = {
+            'token:test': make_jwt(3600),
+            'token:other_service': make_jwt(10),
+        }
+        self.get_auth0_token.return_value = 'fetched-token'
+
+        tokens = self.token_manager.prefetch_tokens(['test', 'other_service'])
+
+        self.assertEqual('fetched-token', tokens['other_service'])
+        self.assertEqual(1, self.get_auth0_token.call_count)
+
+    def test_refresh_all_tokens_summary(self):
+        error = Exception('Auth0 is down')
+
+        def fetch(audience, *args):
+            if audience == 'other_id':
+                raise error
+            return 'token'
+
+        self.get_auth0_token.side_effect = fetch
+
+        summary = self.token_manager.refresh_all_tokens(max_workers=2)
+
+        self.assertEqual({'refreshed': ['test'], 'failed': {'other_service': error}}, summary)
+        self.storage_mock.set_many.assert_called_once_with({'token:test': 'token'}, timeout=ANY)
+
+    def test_refresh_all_tokens_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch(*args):
+            # Both fetches have to be in flight at once for the barrier to open.
+            barrier.wait()
+            return 'token'
+
+        self.get_auth0_token.side_effect = fetch
+
+        summary = self.token_manager.refresh_all_tokens()
+
+        self.assertEqual(['test', 'other_service'], summary['refreshed'])
+
+
+def make_jwt(expires_in):
+    payload = base64.urlsafe_b64encode(
+        json.dumps({'exp': int(time.time() + expires_in)}).encode()
+    ).decode().rstrip('=')
+    return 'header.{}.signature'.format(payload)
+
+
+class TokenExpiryTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = FakeStorage()
+        self.get_auth0_token = MagicMock(side_effect=lambda *args: make_jwt(3600))
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(self.get_auth0_token)
+        )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+        self.collector = MagicMock()
+        self.token_manager = TokenManager(
+            {
+                'api_ids': {'test': 'test_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+            refresh_skew=60,
+            collector=self.collector,
+        )
+
+    def test_get_token_expiry(self):
+        token = make_jwt(100)
+        self.assertAlmostEqual(time.time() + 100, get_token_expiry(token), delta=2)
+        self.assertIsNone(get_token_expiry('opaque-token'))
+        self.assertIsNone(get_token_expiry('a.b.c'))
+        self.assertIsNone(get_token_expiry(None))
+
+    def test_missing_token_is_fetched(self):
+        token = self.token_manager.get_token('test')
+        self.assertEqual(token, self.storage.get('token:test'))
+        self.assertEqual(1, self.get_auth0_token.call_count)
+        self.collector.timing.assert_called_once()
+        self.assertEqual('token.ttl', self.collector.gauge.call_args[0][0])
+
+    def test_fresh_token_is_served(self):
+        token = make_jwt(3600)
+        self.storage.set('token:test', token)
+        self.assertEqual(token, self.token_manager.get_token('test'))
+        self.get_auth0_token.assert_not_called()
+
+    def test_opaque_token_is_served(self):
+        self.storage.set('token:test', 'opaque-token')
+        self.assertEqual('opaque-token', self.token_manager.get_token('test'))
+        self.get_auth0_token.assert_not_called()
+
+    def test_expires_in_is_used_for_opaque_tokens(self):
+        self.get_auth0_token.side_effect = lambda *args: 'opaque-token'
+        self.token_manager.get_token('test')
+
+        self.assertAlmostEqual(
+            time.time() + 86400,
+            self.token_manager._get_expiry('test', 'opaque-token'),
+            delta=2,
+        )
+        self.assertIsNone(self.token_manager._get_expiry('test', 'other-token'))
+
+        with patch('mbq.client.token_manager.time.time', return_value=time.time() + 86400):
+            self.token_manager.get_token('test')
+        self.assertEqual(2, self.get_auth0_token.call_count)
+
+    def test_expired_token_is_refreshed_inline(self):
+        self.storage.set('token:test', make_jwt(-10))
+        token = self.token_manager.get_token('test')
+        self.assertEqual(token, self.storage.get('token:test'))
+        self.assertEqual(1, self.get_auth0_token.call_count)
+
+    def test_expiring_token_is_refreshed_in_background(self):
+        expiring_token = make_jwt(30)
+        self.storage.set('token:test', expiring_token)
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch(*args):
+            started.set()
+            release.wait(5)
+            return make_jwt(3600)
+
+        self.get_auth0_token.side_effect = slow_fetch
+
+        self.assertEqual(expiring_token, self.token_manager.get_token('test'))
+        self.assertTrue(started.wait(5))
+        # A refresh is already running, so no second one is started.
+        self.assertEqual(expiring_token, self.token_manager.get_token('test'))
+        release.set()
+
+        for _ in range(50):
+            if self.storage.get('token:test') != expiring_token:
+                break
+            time.sleep(0.01)
+
+        self.assertNotEqual(expiring_token, self.storage.get('token:test'))
+        self.assertEqual(1, self.get_auth0_token.call_count)
+
+
+class StaleWhileRevalidateTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = MagicMock(wraps=FakeStorage())
+        self.get_auth0_token = MagicMock(side_effect=lambda *args: make_jwt(3600))
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(self.get_auth0_token)
+        )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+        self.token_manager = TokenManager(
+            {
+                'api_ids': {'test': 'test_id', 'other_service': 'other_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+            refresh_skew=300,
+            expiry_margin=60,
+        )
+
+    def run_in_foreground(self, target, name, daemon):
+        thread = MagicMock()
+        thread.start.side_effect = target
+        return thread
+
+    def test_storage_timeout_follows_token_expiry(self):
+        self.token_manager.refresh_token('test')
+        self.assertAlmostEqual(3600 - 60, self.storage.set.call_args[1]['timeout'], delta=2)
+
+    def test_bulk_storage_timeout_uses_soonest_expiry(self):
+        self.get_auth0_token.side_effect = (
+            lambda audience, *args: make_jwt(600 if audience == 'other_id' else 3600)
+        )
+        self.token_manager.refresh_all_tokens()
+        self.assertAlmostEqual(600 - 60, self.storage.set_many.call_args[1]['timeout'], delta=2)
+
+    def test_stale_token_is_served_while_another_process_renews_it(self):
+        stale_token = make_jwt(200)
+        self.storage.set('token:test', stale_token)
+        self.storage.add('lock:token:test', 1)
+
+        with patch('mbq.client.token_manager.threading.Thread', self.run_in_foreground):
+            self.assertEqual(stale_token, self.token_manager.get_token('test'))
+
+        self.get_auth0_token.assert_not_called()
+        self.assertEqual(stale_token, self.storage.get('token:test'))
+
+    def test_one_process_renews_stale_token(self):
+        stale_token = make_jwt(200)
+        self.storage.set('token:test', stale_token)
+
+        with patch('mbq.client.token_manager.threading.Thread', self.run_in_foreground):
+            self.assertEqual(stale_token, self.token_manager.get_token('test'))
+
+        self.assertEqual(1, self.get_auth0_token.call_count)
+        self.assertNotEqual(stale_token, self.storage.get('token:test'))
+        self.storage.add.assert_called_once_with('lock:token:test', 1, timeout=10)
+        self.storage.delete.assert_called_once_with('lock:token:test')
+
+
+class LocalCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = MagicMock(wraps=FakeStorage())
+        self.get_auth0_token = MagicMock(side_effect=lambda *args: make_jwt(3600))
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(self.get_auth0_token)
+        )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+        self.token_manager = TokenManager(
+            {
+                'api_ids': {'test': 'test_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+            refresh_skew=60,
+            local_cache=True,
+            local_cache_ttl=30,
+        )
+
+    def test_hits_skip_storage(self):
+        token = make_jwt(3600)
+        self.storage.set('token:test', token)
+
+        for _ in range(3):
+            self.assertEqual(token, self.token_manager.get_token('test'))
+
+        self.assertEqual(1, self.storage.get.call_count)
+        self.assertEqual(2, self.token_manager.stats['local_cache.hit'])
+        self.assertEqual(1, self.token_manager.stats['local_cache.miss'])
+
+    def test_refreshed_tokens_are_cached(self):
+        token = self.token_manager.get_token('test')
+        self.assertEqual(token, self.token_manager.get_token('test'))
+        self.assertEqual(1, self.storage.get.call_count)
+        self.assertEqual(1, self.get_auth0_token.call_count)
+
+    def test_expiring_tokens_fall_through(self):
+        self.storage.set('token:test', make_jwt(30))
+        with patch.object(self.token_manager, '_refresh_in_background'):
+            self.token_manager.get_token('test')
+            self.token_manager.get_token('test')
+        self.assertEqual(2, self.storage.get.call_count)
+        self.assertEqual(0, self.token_manager.stats['local_cache.hit'])
+
+    def test_opaque_tokens_expire_after_ttl(self):
+        self.storage.set('token:test', 'opaque-token')
+        self.token_manager.get_token('test')
+        self.token_manager.get_token('test')
+        self.assertEqual(1, self.storage.get.call_count)
+
+        with patch('mbq.client.token_manager.time.time', return_value=time.time() + 31):
+            self.token_manager.get_token('test')
+        self.assertEqual(2, self.storage.get.call_count)
+
+    def test_disabled(self):
+        self.token_manager.local_cache = False
+        self.storage.set('token:test', make_jwt(3600))
+        self.token_manager.get_token('test')
+        self.token_manager.get_token('test')
+        self.assertEqual(2, self.storage.get.call_count)
+        self.assertEqual({}, dict(self.token_manager.stats))
+
+
+class InvalidateTokenTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = FakeStorage()
+        self.get_auth0_token = MagicMock(return_value='new-token')
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(self.get_auth0_token)
         )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+        self.token_manager = TokenManager(
+            {
+                'api_ids': {'test': 'test_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+            local_cache=True,
+        )
+
+    def test_rejected_token_is_replaced(self):
+        self.storage.set('token:test', 'rejected-token')
+        self.assertEqual('rejected-token', self.token_manager.get_token('test'))
+
+        self.assertEqual(
+            'new-token', self.token_manager.invalidate_token('test', 'rejected-token')
+        )
+        self.assertEqual('new-token', self.storage.get('token:test'))
+        self.assertEqual('new-token', self.token_manager.get_token('test'))
+        self.assertEqual(1, self.token_manager.stats['invalidated'])
+
+    def test_already_replaced_token_is_not_fetched_again(self):
+        self.storage.set('token:test', 'replacement-token')
+
+        self.assertEqual(
+            'replacement-token', self.token_manager.invalidate_token('test', 'rejected-token')
+        )
+        self.get_auth0_token.assert_not_called()
+
+    def test_invalidate_without_token(self):
+        self.storage.set('token:test', 'current-token')
+        self.assertEqual('new-token', self.token_manager.invalidate_token('test'))
+        self.assertEqual(1, self.get_auth0_token.call_count)
+
+    def test_version_changes_on_fetch_and_invalidation(self):
+        self.storage.set('token:test', 'current-token')
+        self.token_manager.get_token('test')
+        self.assertEqual(0, self.token_manager.get_token_version('test'))
+
+        self.token_manager.invalidate_token('test', 'current-token')
+        # Bumped once for the invalidation and once for the fetch that replaced it.
+        self.assertEqual(2, self.token_manager.get_token_version('test'))
+
+
+class SingleFlightRefreshTestCase(TestCase):
+
+    def setUp(self):
+        self.storage = FakeStorage()
+        self.release = threading.Event()
+        self.fetches = 0
+
+        def slow_fetch(*args):
+            self.fetches += 1
+            fetch = self.fetches
+            self.release.wait(5)
+            return 'token-{}'.format(fetch)
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token', token_response(slow_fetch)
+        )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+    def make_token_manager(self, **kwargs):
+        return TokenManager(
+            {
+                'api_ids': {'test': 'test_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+            **kwargs
+        )
+
+    def refresh_concurrently(self, token_managers):
+        results = []
+        threads = [
+            threading.Thread(target=lambda tm=tm: results.append(tm.refresh_token('test')))
+            for tm in token_managers
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_threads_share_one_fetch(self):
+        token_manager = self.make_token_manager()
+        results = self.refresh_concurrently([token_manager] * 5)
+
+        self.assertEqual(['token-1'] * 5, results)
+        self.assertEqual(1, self.fetches)
+        self.assertEqual('token-1', self.storage.get('token:test'))
+
+        # Later refreshes fetch a new token.
+        self.assertEqual('token-2', token_manager.refresh_token('test'))
+
+    def test_refresh_all_tokens_shares_fetches_with_requests(self):
+        token_manager = self.make_token_manager()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(token_manager.refresh_all_tokens())),
+            threading.Thread(target=lambda: results.append(token_manager.get_token('test'))),
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(1, self.fetches)
+        self.assertIn('token-1', results)
+        self.assertIn({'refreshed': ['test'], 'failed': {}}, results)
+        self.assertEqual('token-1', self.storage.get('token:test'))
+
+    def test_waiting_for_refresh_respects_deadline(self):
+        token_manager = self.make_token_manager()
+        thread = threading.Thread(target=token_manager.refresh_token, args=('test',))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.release.set)
+        while not self.fetches:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            with deadline_scope(time.monotonic() + 0.1):
+                token_manager.refresh_token('test')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(1, self.fetches)
+
+    def test_lock_timeout_falls_back_to_direct_fetch(self):
+        token_manager = self.make_token_manager(lock_timeout=0.05)
+        results = self.refresh_concurrently([token_manager] * 2)
+
+        self.assertEqual(['token-1', 'token-2'], sorted(results))
+        self.assertEqual(2, self.fetches)
+
+    def test_processes_share_one_fetch(self):
+        token_managers = [
+            self.make_token_manager(distributed_lock=True, lock_timeout=2) for _ in range(3)
+        ]
+        for token_manager in token_managers:
+            token_manager.lock_poll_interval = 0.01
+
+        results = self.refresh_concurrently(token_managers)
+
+        self.assertEqual(['token-1'] * 3, results)
+        self.assertEqual(1, self.fetches)
+        self.assertIsNone(self.storage.get('lock:token:test'))
+
+    def test_distributed_lock_timeout_falls_back_to_direct_fetch(self):
+        self.storage.add('lock:token:test', 1)
+        self.release.set()
+        token_manager = self.make_token_manager(distributed_lock=True, lock_timeout=0.05)
+        token_manager.lock_poll_interval = 0.01
+
+        self.assertEqual('token-1', token_manager.refresh_token('test'))
+
+
+class LegacyStorageTestCase(TestCase):
+    """ Storage backends written against the original get/set(key, value) interface. """
+
+    def setUp(self):
+        self.storage = LegacyStorage()
+
+        get_auth0_token_patch = patch(
+            'mbq.client.token_manager.fetch_access_token',
+            token_response(lambda audience, *args: 'token-{}'.format(audience)),
+        )
+        get_auth0_token_patch.start()
+        self.addCleanup(get_auth0_token_patch.stop)
+
+        self.token_manager = TokenManager(
+            {
+                'api_ids': {'test': 'test_id', 'other_service': 'other_id'},
+                'client_id': 'client_id',
+                'client_secret': 'secret',
+                'domain': 'auth0.com',
+            },
+            storage=self.storage,
+        )
+
+    def test_get_token(self):
+        self.assertEqual('token-test_id', self.token_manager.get_token('test'))
+        self.assertEqual({'token:test': 'token-test_id'}, self.storage.data)
+
+    def test_refresh_all_tokens(self):
+        summary = self.token_manager.refresh_all_tokens()
+
+        self.assertEqual({}, summary['failed'])
+        self.assertEqual(
+            {'token:test': 'token-test_id', 'token:other_service': 'token-other_id'},
+            self.storage.data,
+        )
+
+    def test_prefetch_tokens(self):
+        self.storage.set('token:test', 'stored-token')
+
+        self.assertEqual(
+            {'test': 'stored-token', 'other_service': 'token-other_id'},
+            self.token_manager.prefetch_tokens(),
+        )
+
+
+class LegacyStorage:
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class FakeStorage:
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+    def get_many(self, keys):
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    def set_many(self, mapping, timeout=None):
+        self.data.update(mapping)
+
+    def add(self, key, value, timeout=None):
+        with self.lock:
+            if key in self.data:
+                return False
+            self.data[key] = value
+            return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
@@ -1,30 +1,417 @@
-from .lib.auth0 import get_access_token
+import base64
+import inspect
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import DeadlineExceeded
+from .lib.auth0 import fetch_access_token
+from .lib.deadlines import get_remaining
+from .lib.metrics import NullCollector
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_token_expiry(token):
+    """ Returns the exp claim of a JWT as a timestamp, or None if the token
+    isn't a JWT or doesn't expire.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        expiry = json.loads(base64.urlsafe_b64decode(payload))['exp']
+        return float(expiry)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def accepts_timeout(method):
+    """ Returns whether a storage method takes a timeout keyword argument. Backends
+    written before timeouts were part of the Storage protocol only take set(key, value).
+    """
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    return any(
+        parameter.name == 'timeout' or parameter.kind == parameter.VAR_KEYWORD
+        for parameter in parameters
+    )
 
 
 class TokenManager(object):
+    """ Fetches access tokens from Auth0 and keeps them in storage.
+
+    Tokens are refreshed inline when missing or expired. Once a token is within
+    refresh_skew seconds of its expiry it is still served, but a refresh is started
+    in a background thread so callers rarely wait on Auth0. Expiry is read from the
+    token's exp claim, or from the expires_in Auth0 returned when this process fetched
+    the token; other tokens are used until storage evicts them.
 
-    def __init__(self, settings, storage):
+    Refreshes are single-flight: threads that need a token while another thread is
+    fetching it wait for that fetch and reuse its result. With distributed_lock=True
+    the same goes for processes sharing a storage backend that supports add() and
+    delete(), such as DjangoCacheStorage. Waiters give up after lock_timeout seconds
+    and fetch a token themselves. Fetching and waiting for a token on behalf of a
+    ServiceClient call with a deadline stop at that deadline with DeadlineExceeded.
+
+    Tokens are stored with a timeout of their remaining lifetime less expiry_margin
+    seconds, so that storage evicts them shortly before they expire. Between entering
+    the refresh window and that point a token is served stale while it is renewed: in
+    the background of a single process, or, when storage supports add(), of whichever
+    process takes the lock first.
+
+    With local_cache=True tokens are also kept in process memory, so most lookups
+    don't touch the storage backend at all. A local copy is used until its token
+    enters the refresh window, or for local_cache_ttl seconds if the token has no
+    expiry. Hits and misses are counted in stats.
+
+    storage can be any implementation of the Storage protocol. Backends whose set()
+    doesn't take a timeout keep tokens until they are replaced.
+    """
+
+    lock_poll_interval = 0.1
+
+    def __init__(self, settings, storage, refresh_skew=300, collector=None, lock_timeout=10,
+                 distributed_lock=False, local_cache=False, local_cache_ttl=60,
+                 expiry_margin=30):
         self.storage = storage
         self.settings = settings
+        self.refresh_skew = refresh_skew
+        self.collector = collector or NullCollector()
+        self.lock_timeout = lock_timeout
+        self.distributed_lock = distributed_lock
+        self.local_cache = local_cache
+        self.local_cache_ttl = local_cache_ttl
+        self.expiry_margin = expiry_margin
+        self.stats = Counter()
+        self._local_tokens = {}
+        self._fetched_expiries = {}
+        self._versions = Counter()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_locks = {}
+        self._refreshed = {}
 
     def get_token(self, service_name):
+        if self.local_cache:
+            token, valid_until = self._local_tokens.get(service_name, (None, 0))
+            if valid_until > time.time():
+                self.stats['local_cache.hit'] += 1
+                return token
+            self.stats['local_cache.miss'] += 1
+
         token = self.storage.get('token:{}'.format(service_name))
-        return token or self.refresh_token(service_name)
+        if not token:
+            return self.refresh_token(service_name)
+
+        expires_at = self._get_expiry(service_name, token)
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+            if ttl <= 0:
+                return self.refresh_token(service_name)
+            if ttl <= self.refresh_skew:
+                self._refresh_in_background(service_name)
+                return token
+
+        self._cache_locally(service_name, token, expires_at)
+        return token
+
+    def _get_expiry(self, service_name, token):
+        expires_at = get_token_expiry(token)
+        if expires_at is None:
+            fetched_token, expires_at = self._fetched_expiries.get(service_name, (None, None))
+            if fetched_token != token:
+                expires_at = None
+        return expires_at
+
+    def get_token_version(self, service_name):
+        """ Returns a number that changes whenever this process fetches or invalidates
+        the service's token, for callers that keep derived values around.
+        """
+        return self._versions[service_name]
+
+    def get_token_valid_until(self, service_name, token):
+        """ Returns the time until which token can be reused without asking for it
+        again: the start of its refresh window, or local_cache_ttl seconds from now for
+        tokens with no known expiry.
+        """
+        return self._get_valid_until(self._get_expiry(service_name, token))
+
+    def _get_valid_until(self, expires_at):
+        if expires_at is not None:
+            return expires_at - self.refresh_skew
+        return time.time() + self.local_cache_ttl
+
+    def _cache_locally(self, service_name, token, expires_at):
+        if self.local_cache:
+            self._local_tokens[service_name] = (token, self._get_valid_until(expires_at))
+
+    def invalidate_token(self, service_name, token=None):
+        """ Replaces a token that was rejected by the service it was sent to and returns
+        the new one. Passing the rejected token avoids another fetch when it has
+        already been replaced, e.g. by a concurrent call for the same rejection.
+        """
+        self.stats['invalidated'] += 1
+        self._versions[service_name] += 1
+        self.collector.increment('token.invalidated', tags={'service_name': service_name})
+
+        local_token, _ = self._local_tokens.get(service_name, (None, 0))
+        if token is None or local_token == token:
+            self._local_tokens.pop(service_name, None)
+
+        if token is not None:
+            current_token = self.storage.get('token:{}'.format(service_name))
+            if current_token and current_token != token:
+                return self.get_token(service_name)
+
+        return self.refresh_token(service_name)
+
+    def _get_storage_timeout(self, expires_at):
+        if expires_at is None:
+            return None
+        return max(int(expires_at - time.time() - self.expiry_margin), 1)
 
     def refresh_token(self, service_name):
-        token = get_access_token(
+        return self._refresh_token(service_name, wait=True)
+
+    def _refresh_token(self, service_name, wait, batch=None):
+        """ Fetches a new token for service_name, unless another thread does so first.
+
+        batch, when given, collects tokens for _fetch_tokens to store in one write:
+        the token is added to it instead of being stored, and the refresh is only
+        recorded, and the service's refresh lock released, once the batch is written.
+        """
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(service_name, threading.Lock())
+            generation, _ = self._refreshed.get(service_name, (0, None))
+
+        if not refresh_lock.acquire(timeout=self._get_lock_timeout()):
+            return self._fetch_after_lock_timeout(service_name)
+
+        try:
+            with self._lock:
+                latest_generation, token = self._refreshed.get(service_name, (0, None))
+            if latest_generation != generation:
+                # Another thread refreshed the token while we were waiting for the lock.
+                return token
+
+            if hasattr(self.storage, 'add') and (self.distributed_lock or not wait):
+                token = self._fetch_token_with_distributed_lock(service_name, wait)
+                if token is None:
+                    # Another process is renewing the token, so ours is still good to use.
+                    return None
+            elif batch is not None:
+                token, expires_at = self._request_token(service_name)
+                batch[service_name] = (token, expires_at, latest_generation, refresh_lock)
+                refresh_lock = None
+                return token
+            else:
+                token = self._fetch_token(service_name)
+
+            self._record_refresh(service_name, latest_generation, token)
+            return token
+        finally:
+            if refresh_lock is not None:
+                refresh_lock.release()
+
+    def _record_refresh(self, service_name, generation, token):
+        with self._lock:
+            self._refreshed[service_name] = (generation + 1, token)
+
+    def _fetch_token_with_distributed_lock(self, service_name, wait=True):
+        key = 'token:{}'.format(service_name)
+        lock_key = 'lock:{}'.format(key)
+        stale_token = self.storage.get(key)
+
+        if self.storage.add(lock_key, 1, timeout=max(math.ceil(self.lock_timeout), 1)):
+            try:
+                return self._fetch_token(service_name)
+            finally:
+                self.storage.delete(lock_key)
+
+        if not wait:
+            return None
+
+        deadline = time.monotonic() + self._get_lock_timeout()
+        while time.monotonic() < deadline:
+            time.sleep(self.lock_poll_interval)
+            token = self.storage.get(key)
+            if token and token != stale_token:
+                return token
+
+        return self._fetch_after_lock_timeout(service_name)
+
+    def _get_lock_timeout(self):
+        # Callers with a deadline, see deadline_scope, don't wait past it.
+        remaining = get_remaining()
+        if remaining is None:
+            return self.lock_timeout
+        return max(min(self.lock_timeout, remaining), 0)
+
+    def _fetch_after_lock_timeout(self, service_name):
+        remaining = get_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded('Deadline passed while waiting for a token refresh')
+
+        logger.warning('Timed out waiting for {} token refresh'.format(service_name))
+        self.collector.increment('token.refresh.lock_timeout', tags={
+            'service_name': service_name,
+        })
+        return self._fetch_token(service_name)
+
+    def _fetch_token(self, service_name):
+        token, expires_at = self._request_token(service_name)
+        self._store_token(service_name, token, expires_at)
+        self._cache_locally(service_name, token, expires_at)
+        return token
+
+    def _store_token(self, service_name, token, expires_at):
+        key = 'token:{}'.format(service_name)
+        if accepts_timeout(self.storage.set):
+            self.storage.set(key, token, timeout=self._get_storage_timeout(expires_at))
+        else:
+            self.storage.set(key, token)
+
+    def _request_token(self, service_name):
+        start = time.monotonic()
+        token_response = fetch_access_token(
             self.settings['api_ids'][service_name],
             self.settings['client_id'],
             self.settings['client_secret'],
             self.settings['domain'],
         )
+        tags = {'service_name': service_name}
+        self.collector.timing('token.refresh.time', (time.monotonic() - start) * 1000, tags=tags)
+
+        token = token_response['access_token']
+        self._versions[service_name] += 1
+        expires_at = get_token_expiry(token)
+        if expires_at is None and token_response.get('expires_in'):
+            expires_at = time.time() + token_response['expires_in']
+            self._fetched_expiries[service_name] = (token, expires_at)
+        if expires_at is not None:
+            self.collector.gauge('token.ttl', expires_at - time.time(), tags=tags)
+
+        return token, expires_at
 
-        self.storage.set(
-            'token:{}'.format(service_name),
-            token
+    def _fetch_tokens(self, service_names, max_workers):
+        """ Refreshes the tokens of several services concurrently and stores them in one
+        batch. Each refresh is single-flight with refresh_token, so threads that need one
+        of the tokens meanwhile wait for it instead of fetching it again. Returns the
+        tokens and the errors, both keyed by service name.
+        """
+        tokens, errors, batch = {}, {}, {}
+        if not service_names:
+            return tokens, errors
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(service_names))) as executor:
+            futures = [
+                (service_name, executor.submit(self._refresh_token, service_name, True, batch))
+                for service_name in service_names
+            ]
+
+        for service_name, future in futures:
+            error = future.exception()
+            if error is None:
+                tokens[service_name] = future.result()
+            else:
+                logger.error('Failed to refresh {} token: {}'.format(service_name, error))
+                errors[service_name] = error
+
+        try:
+            if batch:
+                self._store_tokens(
+                    {service_name: entry[0] for service_name, entry in batch.items()},
+                    {service_name: entry[1] for service_name, entry in batch.items()},
+                )
+                for service_name, (token, expires_at, generation, _) in batch.items():
+                    self._cache_locally(service_name, token, expires_at)
+                    self._record_refresh(service_name, generation, token)
+        finally:
+            for _, _, _, refresh_lock in batch.values():
+                refresh_lock.release()
+
+        return tokens, errors
+
+    def _store_tokens(self, tokens, expiries):
+        """ Writes several tokens with one set_many, or one set per token on backends
+        that don't have it.
+        """
+        if not hasattr(self.storage, 'set_many'):
+            for service_name, token in tokens.items():
+                self._store_token(service_name, token, expiries[service_name])
+            return
+
+        # One timeout covers the whole batch, so use the soonest expiry.
+        timeouts = [self._get_storage_timeout(expires_at) for expires_at in expiries.values()]
+        known_timeouts = [timeout for timeout in timeouts if timeout is not None]
+        self.storage.set_many({
+            'token:{}'.format(service_name): token
+            for service_name, token in tokens.items()
+        }, timeout=min(known_timeouts) if known_timeouts else None)
+
+    def _load_tokens(self, service_names):
+        keys = ['token:{}'.format(service_name) for service_name in service_names]
+        if hasattr(self.storage, 'get_many'):
+            return self.storage.get_many(keys)
+        return {key: self.storage.get(key) for key in keys}
+
+    def _refresh_in_background(self, service_name):
+        with self._lock:
+            if service_name in self._refreshing:
+                return
+            self._refreshing.add(service_name)
+
+        def refresh():
+            try:
+                self._refresh_token(service_name, wait=False)
+            except Exception:
+                logger.exception('Background refresh of {} token failed'.format(service_name))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(service_name)
+
+        thread = threading.Thread(
+            target=refresh, name='refresh-token-{}'.format(service_name), daemon=True
         )
-        return token
+        thread.start()
+
+    def refresh_all_tokens(self, max_workers=8):
+        """ Refreshes the tokens for every configured service, up to max_workers at a time.
+
+        A failure for one service doesn't stop the others. Returns a dict with the names
+        of the services that were refreshed under 'refreshed' and the exception raised
+        for each one that failed under 'failed'.
+        """
+        tokens, errors = self._fetch_tokens(list(self.settings['api_ids']), max_workers)
+        return {'refreshed': list(tokens), 'failed': errors}
+
+    def prefetch_tokens(self, service_names=None, max_workers=8):
+        """ Loads the tokens for service_names (by default every configured service) with
+        one bulk read from storage, fetching any that are missing or due for a refresh.
+        Returns the tokens that are available, keyed by service name.
+        """
+        if service_names is None:
+            service_names = list(self.settings['api_ids'])
+
+        stored = self._load_tokens(service_names)
+
+        tokens, missing = {}, []
+        for service_name in service_names:
+            token = stored.get('token:{}'.format(service_name))
+            expires_at = self._get_expiry(service_name, token)
+            if token and (expires_at is None or expires_at - time.time() > self.refresh_skew):
+                tokens[service_name] = token
+                self._cache_locally(service_name, token, expires_at)
+            else:
+                missing.append(service_name)
 
-    def refresh_all_tokens(self):
-        for service_name in self.settings['api_ids']:
-            self.refresh_token(service_name)
+        fetched, _ = self._fetch_tokens(missing, max_workers)
+        tokens.update(fetched)
+        return tokens
@@ -42,6 +42,11 @@ setuptools.setup(
         'requests>=2.21.0,<3.0.0',
         'typing_extensions>=3.7.2',
     ],
+    extras_require={
+        'async': ['httpx>=0.18'],
+        'brotli': ['brotli>=1.0'],
+        'orjson': ['orjson>=3.0'],
+    },
     keywords='token access authorization',
     packages=setuptools.find_packages(),
     include_package_data=True,